@@ -22,14 +22,110 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from link import FloatRegister
-from tools import report
+from link import FloatRegister, VERIFY_READ
+from tasks import Result
+from instrument import traced
+from tools import debug, report, warn
+
+from collections import namedtuple
+from time import time, sleep
+
+# Outcome of AnalogGroup.play: samples written, how many started more
+# than one period late, and the worst lateness.
+Playback = namedtuple('Playback', 'samples missed late_ms')
 
 class Analog(object):
     def __init__(self, link, aValue):
-        report("Analog(aValue=%s)" % repr(aValue))
+        debug("Analog(aValue=%r)", aValue)
         self.rValue = FloatRegister(link, aValue)
 
+    @traced('Analog.set')
     def set(self, value):
-        report("Analog.set(%s)" % repr(value))
+        report("Analog.set(%r)", value)
         self.rValue.write(float(value))
+
+    def setTask(self, value):
+        self.set(value)
+        yield Result(None)
+
+class AnalogGroup(object):
+    # Sets several analog outputs together. By default each contiguous
+    # run of words is written as one block. With spanGaps, one write
+    # covers the whole span so every channel changes at once; the words
+    # between channels are read just before and written back unchanged.
+    # Nothing stops another client writing those words in between, so
+    # spanGaps is only safe on a link that has the controller to itself.
+    def __init__(self, link, analogs, spanGaps=False):
+        self.link = link
+        self.registers = [analog.rValue for analog in analogs]
+        self.offsets = []
+        for register in self.registers:
+            self.offsets.extend(register.addresses())
+        self.start = min(self.offsets)
+        self.count = max(self.offsets) + 1 - self.start
+        self.spanGaps = spanGaps
+
+    @traced('AnalogGroup.set_all')
+    def set_all(self, values):
+        debug("AnalogGroup.set_all(%r)", values)
+        if not isinstance(values, (list, tuple)):
+            values = [values] * len(self.registers)
+        assert len(values) == len(self.registers)
+
+        words = []
+        for (register, value) in zip(self.registers, values):
+            words.extend(register.encode(float(value)))
+
+        if not self.spanGaps:
+            nwords = self.link.write_many(self.offsets, words)
+        else:
+            block = self.link.read_fresh(self.start, self.count)
+            for (offset, word) in zip(self.offsets, words):
+                block[offset - self.start] = word
+            block = self.link.write_block(self.start, block)
+            nwords = [block[offset - self.start] for offset in self.offsets]
+
+        # Verify written values.
+        nvalues = []
+        for register in self.registers:
+            width = len(register.addresses())
+            nvalues.append(register.decode(nwords[:width]))
+            nwords = nwords[width:]
+        for (register, value, nvalue) in zip(self.registers, values, nvalues):
+            if (self.link.verify == VERIFY_READ) and \
+               (nvalue != register.decode(register.encode(float(value)))):
+                warn('address %ld float, wrote %f, returned %f',
+                     register.offset, value, nvalue)
+        return nvalues
+
+    def play(self, samples, rate):
+        # Write each sample at a steady rate, scheduling from the start
+        # time so delays do not accumulate.
+        report("AnalogGroup.play(%r Hz)", rate)
+        period = 1.0 / rate
+        t0 = time()
+        count = 0
+        missed = 0
+        worst = 0.0
+        for values in samples:
+            delay = (t0 + count * period) - time()
+            if delay > 0:
+                sleep(delay)
+            else:
+                worst = max(worst, -delay)
+                if -delay > period:
+                    missed += 1
+            self.set_all(values)
+            count += 1
+
+        report("AnalogGroup.play: %d samples, %d missed, worst %.1f ms late",
+               count, missed, worst * 1000)
+        return Playback(count, missed, int(worst * 1000))
+
+def ramp(start, end, steps):
+    # Evenly spaced values from start to end inclusive.
+    for index in xrange(steps):
+        if steps > 1:
+            yield start + (end - start) * index / float(steps - 1)
+        else:
+            yield end
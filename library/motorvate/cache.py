@@ -0,0 +1,91 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from link import ControlLink
+
+from time import time
+
+class CachedLink(ControlLink):
+    # Serves reads inside a set of address blocks from a snapshot taken
+    # with one request per block. The snapshot is refreshed once it is
+    # older than ttl seconds, or when a read touches a word written since.
+    def __init__(self, host, port, verify, blocks, ttl=0.05, **options):
+        ControlLink.__init__(self, host, port, verify, **options)
+        self.blocks = [(long(start), long(count)) for (start, count) in blocks]
+        self.ttl = float(ttl)
+        self.words = None
+        self.taken = 0.0
+        self.dirty = set()
+
+    def covers(self, start, count):
+        for (first, size) in self.blocks:
+            if (start >= first) and (start + count <= first + size):
+                return True
+        return False
+
+    def isStale(self, start, count):
+        if self.words is None:
+            return True
+        if (time() - self.taken) > self.ttl:
+            return True
+        for offset in xrange(start, start + count):
+            if offset in self.dirty:
+                return True
+        return False
+
+    def refresh(self):
+        # Take a new snapshot of every block, one request each.
+        words = {}
+        for (start, count) in self.blocks:
+            block = ControlLink.read_block(self, start, count)
+            for (index, value) in enumerate(block):
+                words[start + index] = value
+        self.words = words
+        self.taken = time()
+        self.dirty.clear()
+        return self.words
+
+    def invalidate(self, start, count=1):
+        for offset in xrange(start, start + count):
+            self.dirty.add(long(offset))
+
+    def read_block(self, start, count):
+        if not self.covers(start, count):
+            return ControlLink.read_block(self, start, count)
+        if self.isStale(start, count):
+            self.refresh()
+        return [self.words[start + index] for index in xrange(count)]
+
+    def read_fresh(self, start, count):
+        # Words read to be written back bypass the snapshot, which may
+        # predate another client's write.
+        return ControlLink.read_block(self, start, count)
+
+    def write(self, offset, value):
+        self.invalidate(offset)
+        return ControlLink.write(self, offset, value)
+
+    def _writeBlock(self, offset, values):
+        self.invalidate(offset, len(values))
+        return ControlLink._writeBlock(self, offset, values)
@@ -22,46 +22,173 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from link import ToggleRegister, DwordRegister, FloatRegister
-from tools import report
+from link import ToggleRegister, DwordRegister, FloatRegister, readRegisters
+from tasks import Result
+from instrument import traced
+from tools import debug, report
+from waits import AdaptiveWait
 
+from collections import namedtuple
 from time import time, sleep
 
+# One of a series of counts: position in the series, wall time counting
+# started, real time counted and the counter values.
+CountSample = namedtuple('CountSample', 'index started taken_ms counts')
+
+# Counts from measure_precise, with the counting time used.
+PreciseCount = namedtuple('PreciseCount', 'counts live_ms slices')
+
+# Shortest slice measure_precise counts for, in milliseconds.
+MIN_SLICE_MS = 100
+
 class Counters(object):
     def __init__(self, link, aSwitch, aBusy, aTime, aValues):
-        report("Counters(aSwitch=%s, aBusy=%s, aTime=%s, aValues=%s)" %
-               (repr(aSwitch), repr(aBusy), repr(aTime), repr(aValues)))
+        debug("Counters(aSwitch=%r, aBusy=%r, aTime=%r, aValues=%r)",
+              aSwitch, aBusy, aTime, aValues)
 
+        self.link = link
         self.rSwitch = ToggleRegister(link, aSwitch)
-        self.rBusy   = ToggleRegister(link, aBusy)
+        self.rBusy   = ToggleRegister(link, aBusy, status=True)
         self.rTime   =  FloatRegister(link, aTime)
         self.rValues = [DwordRegister(link, aValue) for aValue in aValues]
 
+        # Strategy for polling until counting completes.
+        self.waits = AdaptiveWait()
+
     def stop(self):
-        report("Counters.stop()")
-        self.rSwitch.write(False)
+        debug("Counters.stop()")
+        with self.link.urgent():
+            self.rSwitch.write(False)
 
     def start(self):
-        report("Counters.start()")
+        debug("Counters.start()")
         self.rSwitch.write(True)
 
     def isBusy(self):
         done = self.rBusy.read()
-        report("Counters.isBusy() -> %s" % repr(done))
+        debug("Counters.isBusy() -> %r", done)
         return done
 
     def setTime(self, time_ms):
-        report("Counters.setTime(%s)" % repr(time_ms))
+        debug("Counters.setTime(%r)", time_ms)
         self.rTime.write(float(int(time_ms)))
 
     def getCounts(self):
-        counts = [rValue.read() for rValue in self.rValues]
-        report("Counters.getCounts() -> %s" % repr(counts))
+        counts = readRegisters(self.link, self.rValues)
+        debug("Counters.getCounts() -> %r", counts)
         return counts
 
+    @traced('Counters.measure')
     def measure(self, time_ms):
-        report("Counters.measure(%s)" % repr(time_ms))
+        report("Counters.measure(%r)", time_ms)
+        t1 = self.startMeasure(time_ms)
+
+        # Wait until time has elapsed.
+        delays = self.waits.begin(time_ms / 1000.0)
+        while self.isBusy():
+            sleep(delays.next())
+
+        return self.finishMeasure(time_ms, t1)
+
+    def measureTask(self, time_ms):
+        report("Counters.measureTask(%r)", time_ms)
+        t1 = self.startMeasure(time_ms)
+
+        # Let other tasks run until time has elapsed.
+        delays = self.waits.begin(time_ms / 1000.0)
+        while self.isBusy():
+            yield delays.next()
+
+        yield Result(self.finishMeasure(time_ms, t1))
+
+    def measure_series(self, time_ms, n):
+        # Yield n counts of time_ms each.
+        return self.countSeries(time_ms, n)
+
+    def measure_stream(self, time_ms):
+        # Yield counts of time_ms each until the generator is closed.
+        return self.countSeries(time_ms, None)
+
+    def countSeries(self, time_ms, n):
+        report("Counters.measure_series(%r, %r)", time_ms, n)
 
+        # Set the preset once and leave it armed for every count.
+        self.stop()
+        self.setTime(time_ms)
+        index = 0
+        try:
+            t1 = time()
+            self.start()
+            while (n is None) or (index < n):
+                counts = self.awaitCounts(time_ms)
+                taken_ms = int((time() - t1) * 1000)
+                sample = CountSample(index, t1, taken_ms, counts)
+                index += 1
+
+                # Re-trigger before handing over this count.
+                if (n is None) or (index < n):
+                    self.stop()
+                    t1 = time()
+                    self.start()
+                yield sample
+        finally:
+            self.stop()
+            self.setTime(0)
+
+    def awaitCounts(self, time_ms):
+        # Poll busy and counter values together, so the final poll is
+        # also the readout.
+        registers = [self.rBusy] + self.rValues
+        delays = self.waits.begin(time_ms / 1000.0)
+        while True:
+            values = readRegisters(self.link, registers)
+            if not values[0]:
+                return values[1:]
+            sleep(delays.next())
+
+    def measure_precise(self, channel, precision, max_ms,
+                        min_ms=MIN_SLICE_MS):
+        # Count in slices until the channel's relative error sqrt(N)/N
+        # reaches precision, or max_ms of counting time has been used.
+        report("Counters.measure_precise(%r, %r, %r)", channel, precision, max_ms)
+        if not (0 <= channel < len(self.rValues)):
+            raise ValueError('No counter channel %r' % channel)
+        if not (precision > 0):
+            raise ValueError('Precision must be positive, not %r' % precision)
+        if not ((max_ms > 0) and (min_ms > 0)):
+            raise ValueError('Counting times must be positive')
+        wanted = 1.0 / (precision * precision)
+        totals = [0L] * len(self.rValues)
+        live_ms = 0
+        slices = 0
+        slice_ms = min(min_ms, max_ms)
+        try:
+            while (totals[channel] < wanted) and (live_ms < max_ms):
+                self.stop()
+                self.setTime(slice_ms)
+                self.start()
+                counts = self.awaitCounts(slice_ms)
+                totals = [total + count for (total, count) in zip(totals, counts)]
+                live_ms += slice_ms
+                slices += 1
+
+                # Size the next slice from the rate seen so far.
+                rate = float(totals[channel]) / live_ms
+                if rate > 0:
+                    slice_ms = int((wanted - totals[channel]) / rate) + 1
+                else:
+                    slice_ms = 2 * slice_ms
+                # Never count past max_ms, even for a short last slice.
+                slice_ms = min(max(min_ms, slice_ms), max_ms - live_ms)
+        finally:
+            self.stop()
+            self.setTime(0)
+
+        report("Counters.measure_precise() -> %r in %d ms (%d slices)",
+               totals, live_ms, slices)
+        return PreciseCount(totals, live_ms, slices)
+
+    def startMeasure(self, time_ms):
         # Stop counters if running.
         self.stop()
 
@@ -73,17 +200,15 @@ class Counters(object):
 
         # Start timer and counters.
         self.start()
+        return t1
 
-        # Wait until time has elapsed.
-        while self.isBusy():
-            sleep(0.1)
-
+    def finishMeasure(self, time_ms, t1):
         # Sample real time.
         t2 = time()
 
         # Calculate and report real time elapsed.
         taken_ms = int((t2 - t1) * 1000)
-        report("Counters.measure(%s) took %d ms" % (repr(time_ms), taken_ms))
+        report("Counters.measure(%r) took %d ms", time_ms, taken_ms)
 
         # Read out counter values.
         counts = self.getCounts()
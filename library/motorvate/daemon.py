@@ -0,0 +1,358 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Local daemon sharing one controller connection between processes.
+#
+# A WorldServer owns the only link to the controller and the World built
+# on it, so device state such as control word shadows and tracked motor
+# state is kept in one place. Clients connect over a Unix socket and
+# WorldClient gives them proxies with the same methods as the devices.
+#
+# Each request is one line of JSON naming a device, a method and its
+# arguments, answered by one line holding the result or the error.
+# Commands run one at a time on each device they use, except stopping
+# counters and disabling relays, which go ahead of any command in
+# progress; queries run at once, share a QueuedLink so identical reads from several clients are
+# sent once, and whole map snapshots are shared for a short time.
+#
+# Operations driving several devices step by step, such as scans, run
+# inside the daemon; StepScan and FlyScan hand themselves over when
+# given a WorldClient. Anything else not served, such as the link or a
+# motor's startMove, raises AttributeError saying so.
+
+from scan import StepScan, FlyScan, ScanPoint, FlyBin
+from counters import CountSample, PreciseCount
+from analog import Playback
+from tools import debug, report, warn
+
+from contextlib import contextmanager
+from time import time
+
+import json
+import os
+import socket
+import SocketServer
+import threading
+
+# Methods served for each device type, split into commands, which
+# change device state and are serialised per device, and queries.
+COMMANDS = {
+    'relay':    ['enable', 'disable'],
+    'analog':   ['set'],
+    'outputs':  ['set_all', 'play'],
+    'counters': ['stop', 'start', 'setTime', 'measure', 'measure_series',
+                 'measure_precise'],
+    'motor':    ['home', 'move', 'forget'],
+    'world':    ['move_many', 'home_all', 'step_scan', 'fly_scan'],
+}
+
+# Commands served without waiting for the device, so a count or scan
+# holding it can be interrupted from another client.
+URGENT = {
+    'relay':    ['disable'],
+    'counters': ['stop'],
+}
+
+QUERIES = {
+    'counters': ['isBusy', 'getCounts'],
+    'motor':    ['isMoving'],
+    'world':    ['describe', 'snapshot'],
+}
+
+# Attributes served for each device type.
+ATTRIBUTES = {
+    'motor':    ['position', 'speed', 'setpoint', 'homed'],
+}
+
+# Results rebuilt by proxies from the lists they travel as.
+RESULTS = {
+    ('counters', 'measure_series'):
+        lambda rows: [CountSample(*row) for row in rows],
+    ('counters', 'measure_precise'):
+        lambda row: PreciseCount(*row),
+    ('outputs', 'play'):
+        lambda row: Playback(*row),
+}
+
+# How long a snapshot is shared between clients, in seconds.
+SNAPSHOT_TTL = 0.05
+
+class RemoteError(RuntimeError):
+    pass
+
+def worldTargets(world):
+    # Every served device by target name, with its type.
+    targets = {'world': (world, 'world')}
+    for (index, relay) in enumerate(world.relays):
+        targets['relays.%d' % index] = (relay, 'relay')
+    for (index, analog) in enumerate(world.analogs):
+        targets['analogs.%d' % index] = (analog, 'analog')
+    if world.analogs:
+        targets['outputs'] = (world.outputs, 'outputs')
+    if world.counters is not None:
+        targets['counters'] = (world.counters, 'counters')
+    for (index, motor) in enumerate(world.motors):
+        targets['motors.%d' % index] = (motor, 'motor')
+    return targets
+
+def describeWorld(world):
+    # Layout a client needs to build its proxies.
+    return {
+        'relays':   len(world.relays),
+        'analogs':  len(world.analogs),
+        'counters': world.counters is not None,
+        'motors':   [device.get('name') for device in world.devices
+                     if device['type'] == 'motor'],
+    }
+
+class WorldServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, world, ttl=SNAPSHOT_TTL):
+        SocketServer.UnixStreamServer.__init__(self, path, WorldHandler)
+        self.path = path
+        self.world = world
+        self.targets = worldTargets(world)
+        self.locks = dict([(target, threading.RLock()) for target in self.targets])
+        self.ttl = float(ttl)
+        self.snapshotLock = threading.Lock()
+        self.words = None
+        self.taken = 0.0
+        self.requests = 0
+        self.shared = 0
+
+    def device(self, target, kind):
+        if (target not in self.targets) or (self.targets[target][1] != kind):
+            raise ValueError('Unknown %s %r' % (kind, target))
+        return self.targets[target][0]
+
+    @contextmanager
+    def locked(self, targets):
+        # Hold the locks of several devices, always in the same order.
+        locks = [self.locks[target] for target in sorted(set(targets))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def call(self, target, method, args):
+        self.requests += 1
+        if target not in self.targets:
+            raise ValueError('Unknown device %r' % target)
+        device, kind = self.targets[target]
+
+        if method == 'attribute':
+            if args[0] not in ATTRIBUTES.get(kind, []):
+                raise ValueError('%s has no attribute %r' % (target, args[0]))
+            return getattr(device, args[0])
+        if method in QUERIES.get(kind, []) + COMMANDS.get(kind, []):
+            if kind == 'world':
+                return self.callWorld(method, args)
+        if method in QUERIES.get(kind, []):
+            return getattr(device, method)(*args)
+        if method not in COMMANDS.get(kind, []):
+            raise ValueError('%s has no method %r' % (target, method))
+        if method in URGENT.get(kind, []):
+            with self.world.link.urgent():
+                return getattr(device, method)(*args)
+        with self.locked([target]):
+            result = getattr(device, method)(*args)
+            if method == 'measure_series':
+                result = list(result)
+            return result
+
+    def callWorld(self, method, args):
+        # Motors travel by target name, and every motor an operation
+        # drives is locked against other clients for its duration.
+        world = self.world
+        if method == 'describe':
+            return describeWorld(world)
+        if method == 'snapshot':
+            return self.snapshot()
+        if method == 'move_many':
+            positions = dict([(self.device(name, 'motor'), position)
+                              for (name, position) in args[0].items()])
+            with self.locked(args[0].keys()):
+                return world.move_many(positions)
+        if method == 'home_all':
+            names = [target for (target, (device, kind)) in self.targets.items()
+                     if kind == 'motor']
+            with self.locked(names):
+                return world.home_all()
+        if method == 'step_scan':
+            names, points, time_ms = args
+            motors = [self.device(name, 'motor') for name in names]
+            with self.locked(names + ['counters']):
+                return list(StepScan(world, motors, points, time_ms))
+        if method == 'fly_scan':
+            name, start, end, bins, interval = args
+            with self.locked([name, 'counters']):
+                return FlyScan(world, self.device(name, 'motor'),
+                               start, end, bins, interval).run()
+
+    def snapshot(self):
+        # Clients polling the whole map share one read per ttl.
+        self.snapshotLock.acquire()
+        try:
+            if (self.words is None) or ((time() - self.taken) > self.ttl):
+                self.words = self.world.snapshot()
+                self.taken = time()
+            else:
+                self.shared += 1
+            return [[offset, word] for (offset, word) in sorted(self.words.items())]
+        finally:
+            self.snapshotLock.release()
+
+class WorldHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        debug("WorldServer: client connected")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                result = self.server.call(str(request['target']),
+                                          str(request['method']),
+                                          request.get('args', []))
+                reply = {'result': result}
+            except Exception, error:
+                warn('WorldServer: %s', error)
+                reply = {'error': '%s: %s' % (type(error).__name__, error)}
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+        debug("WorldServer: client disconnected")
+
+class WorldClient(object):
+    # Proxy for a World served by a WorldServer.
+    remote = True
+
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rb')
+        self.lock = threading.Lock()
+
+        layout = self.call('world', 'describe')
+        self.relays = [DeviceProxy(self, 'relays.%d' % index, 'relay')
+                       for index in xrange(layout['relays'])]
+        self.analogs = [DeviceProxy(self, 'analogs.%d' % index, 'analog')
+                        for index in xrange(layout['analogs'])]
+        if self.analogs:
+            self.outputs = DeviceProxy(self, 'outputs', 'outputs')
+        self.counters = None
+        if layout['counters']:
+            self.counters = DeviceProxy(self, 'counters', 'counters')
+        self.motors = []
+        for (index, name) in enumerate(layout['motors']):
+            motor = DeviceProxy(self, 'motors.%d' % index, 'motor')
+            self.motors.append(motor)
+            if name:
+                setattr(self, name, motor)
+
+    def call(self, target, method, *args):
+        self.lock.acquire()
+        try:
+            request = {'target': target, 'method': method, 'args': list(args)}
+            # Sample generators and the like travel as lists.
+            self.sock.sendall(json.dumps(request, default=list) + '\n')
+            line = self.stream.readline()
+        finally:
+            self.lock.release()
+        if not line:
+            raise RemoteError('Daemon at %s closed the connection' % self.path)
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RemoteError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def snapshot(self):
+        return dict([(long(offset), long(word))
+                     for (offset, word) in self.call('world', 'snapshot')])
+
+    def move_many(self, positions):
+        report("World.move_many(%r)", positions)
+        self.call('world', 'move_many',
+                  dict([(motor.target, position)
+                        for (motor, position) in positions.items()]))
+
+    def home_all(self):
+        report("World.home_all()")
+        self.call('world', 'home_all')
+
+    def step_scan(self, motors, points, time_ms):
+        return [ScanPoint(index, tuple(position), counts, started, taken_ms)
+                for (index, position, counts, started, taken_ms)
+                in self.call('world', 'step_scan', [motor.target for motor in motors],
+                             points, time_ms)]
+
+    def fly_scan(self, motor, start, end, bins, interval):
+        return [FlyBin(*row) for row in
+                self.call('world', 'fly_scan', motor.target, start, end, bins, interval)]
+
+    def __getattr__(self, name):
+        raise AttributeError('World.%s is not served by the daemon at %s'
+                             % (name, self.__dict__.get('path')))
+
+class DeviceProxy(object):
+    def __init__(self, client, target, kind):
+        self.client = client
+        self.target = target
+        self.kind = kind
+        self.methods = COMMANDS.get(kind, []) + QUERIES.get(kind, [])
+        self.attributes = ATTRIBUTES.get(kind, [])
+
+    def __repr__(self):
+        return 'DeviceProxy(%s)' % self.target
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get('attributes', []):
+            return self.client.call(self.target, 'attribute', name)
+        if name not in self.__dict__.get('methods', []):
+            raise AttributeError('%s.%s is not served by the daemon'
+                                 % (self.__dict__.get('target'), name))
+        convert = RESULTS.get((self.kind, name), lambda result: result)
+        def call(*args):
+            return convert(self.client.call(self.target, name, *args))
+        return call
+
+def serveWorld(path, world):
+    # Serve a world until interrupted, replacing any stale socket.
+    if os.path.exists(path):
+        os.unlink(path)
+    server = WorldServer(path, world)
+    report("WorldServer listening on %s", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
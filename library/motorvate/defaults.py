@@ -22,18 +22,79 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from link import ControlLink
-from world import World
+from link import ControlLink, VERIFY_READ
+from cache import CachedLink
+from queued import QueuedLink
+from world import World, WORLD_MAP
+from registermap import ReadPlan, loadMap
+from fleet import Fleet, parseEndpoints
+from traffic import ReplayConnection, recordLink
+from daemon import WorldClient
 
 from pymodbus.constants import Defaults
 
+import atexit
 import os
 
 host = os.getenv('XRD_HOST', 'localhost')
 port = int(os.getenv('XRD_PORT', str(Defaults.Port)))
 
-def makeLink():
-    return ControlLink(host, port)
+# Every instrument for a fleet, as 'host[:port], ...'.
+hosts = os.getenv('XRD_HOSTS', '%s:%d' % (host, port))
 
-def makeWorld():
-    return World(makeLink())
+# Block write verification: 'none', 'echo' or 'read'.
+verify = os.getenv('XRD_VERIFY', VERIFY_READ)
+
+# Snapshot lifetime for cached reads, or 0 to read every word directly.
+cache_ms = int(os.getenv('XRD_CACHE_MS', '0'))
+
+# How long a control word read or written may be reused instead of read
+# again before changing its bits, or 0 to always read. Only safe when
+# nothing else drives the controller.
+shadow_ms = int(os.getenv('XRD_SHADOW_MS', '0'))
+
+# Register map as JSON, or the built-in World map if not given.
+map_path = os.getenv('XRD_MAP')
+devices = map_path and loadMap(map_path) or WORLD_MAP
+
+# Share one link safely between threads if 1. Cannot be combined with
+# the cache.
+queued = os.getenv('XRD_QUEUED', '0') == '1'
+
+# Record link traffic to this trace file.
+trace_path = os.getenv('XRD_TRACE')
+
+# Serve link traffic from this trace file instead of the device, loosely
+# matching requests, and at recorded timing if XRD_REPLAY_TIMING is 1.
+replay_path = os.getenv('XRD_REPLAY')
+replay_timing = os.getenv('XRD_REPLAY_TIMING', '0') == '1'
+
+# Unix socket of a daemon sharing the default host between processes.
+daemon_path = os.getenv('XRD_DAEMON')
+daemon_endpoint = (host, port)
+
+def makeLink(host=host, port=port):
+    if queued and (cache_ms > 0):
+        raise ValueError('XRD_QUEUED cannot be combined with XRD_CACHE_MS')
+    conn = None
+    if replay_path:
+        conn = ReplayConnection(replay_path, False, replay_timing)
+    options = {'conn': conn, 'shadowAge': shadow_ms / 1000.0}
+    if cache_ms > 0:
+        link = CachedLink(host, port, verify,
+                          ReadPlan(devices).blocks, cache_ms / 1000.0, **options)
+    elif queued:
+        link = QueuedLink(host, port, verify, **options)
+    else:
+        link = ControlLink(host, port, verify, **options)
+    if trace_path:
+        atexit.register(recordLink(link, trace_path).close)
+    return link
+
+def makeWorld(host=host, port=port):
+    if daemon_path and ((host, port) == daemon_endpoint):
+        return WorldClient(daemon_path)
+    return World(makeLink(host, port), devices)
+
+def makeFleet():
+    return Fleet(parseEndpoints(hosts, port), makeWorld)
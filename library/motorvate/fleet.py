@@ -0,0 +1,160 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Running operations across several instruments from one process.
+#
+# Each instrument has its own worker thread and job queue, so jobs for
+# one host run in order while hosts run in parallel, and a slow or
+# unreachable controller only holds up its own queue. Its World is
+# built on first use in that thread.
+
+from pipeline import Future
+from tools import report, warn
+from waits import DEFAULT_TIMEOUT
+
+from time import time
+
+import Queue
+import threading
+
+def parseEndpoints(text, port):
+    # Parse 'host[:port], ...' into (host, port) pairs.
+    endpoints = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if ':' in item:
+            name, number = item.rsplit(':', 1)
+            endpoints.append((name, int(number)))
+        else:
+            endpoints.append((item, port))
+    return endpoints
+
+class Instrument(object):
+    def __init__(self, host, port, factory):
+        self.host = host
+        self.port = port
+        self.factory = factory
+        self.world = None
+        self.queue = Queue.Queue()
+        self.jobs = 0
+        self.failures = 0
+        self.busy = 0.0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def __repr__(self):
+        return 'Instrument(%s:%d)' % (self.host, self.port)
+
+    def submit(self, function, *args):
+        # Queue function(world, *args), returning a future for its result.
+        future = Future()
+        self.queue.put((future, function, args))
+        return future
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            future, function, args = job
+            t1 = time()
+            try:
+                if self.world is None:
+                    self.world = self.factory(self.host, self.port)
+                future.set(function(self.world, *args))
+            except Exception, error:
+                warn('%r job failed: %s', self, error)
+                self.failures += 1
+                future.fail(error)
+            self.jobs += 1
+            self.busy += time() - t1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+class Fleet(object):
+    # Jobs not finished within timeout seconds count as failed, so one
+    # hung controller cannot stall a call across the fleet.
+    def __init__(self, endpoints, factory, timeout=DEFAULT_TIMEOUT):
+        self.instruments = [Instrument(host, port, factory)
+                            for (host, port) in endpoints]
+        self.timeout = float(timeout)
+        self.started = time()
+
+    def __iter__(self):
+        return iter(self.instruments)
+
+    def close(self):
+        for instrument in self.instruments:
+            instrument.close()
+
+    def broadcast(self, function, *args):
+        # Queue the same job on every instrument.
+        return [instrument.submit(function, *args)
+                for instrument in self.instruments]
+
+    def gather(self, futures, timeout=None):
+        # Wait for every job up to one shared deadline, keeping
+        # exceptions in place of failed or unfinished results.
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time() + timeout
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(max(deadline - time(), 0.0)))
+            except Exception, error:
+                results.append(error)
+        return results
+
+    def run(self, function, *args, **options):
+        return self.gather(self.broadcast(function, *args),
+                           options.get('timeout'))
+
+    # Common operations across the fleet.
+
+    def home_all(self):
+        report("Fleet.home_all()")
+        return self.run(lambda world: world.home_all())
+
+    def measure(self, time_ms):
+        report("Fleet.measure(%r)", time_ms)
+        return self.run(lambda world: world.counters.measure(time_ms))
+
+    def stats(self):
+        # Jobs, failures, busy time and throughput per host and in total.
+        elapsed = max(time() - self.started, 1e-9)
+        lines = []
+        for instrument in self.instruments:
+            lines.append('%s:%d %6d jobs %4d failed %8.1f s busy %8.2f jobs/s'
+                         % (instrument.host, instrument.port, instrument.jobs,
+                            instrument.failures, instrument.busy,
+                            instrument.jobs / elapsed))
+        jobs = sum([instrument.jobs for instrument in self.instruments])
+        lines.append('total %6d jobs in %.1f s, %.2f jobs/s' % (jobs, elapsed, jobs / elapsed))
+        return '\n'.join(lines)
@@ -0,0 +1,135 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Instrumentation for the link and for high level device operations.
+#
+# Set a LinkStats as a link's 'stats' to record every request. Device
+# methods marked with traced() call each installed tracer, a callable
+# taking the operation name and returning a context manager around it.
+
+from contextlib import contextmanager, nested
+from time import time
+
+# Upper bounds of latency histogram buckets, in seconds.
+BUCKETS = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005,
+           0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+class Histogram(object):
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, seconds):
+        index = 0
+        while (index < len(self.bounds)) and (seconds > self.bounds[index]):
+            index += 1
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding this fraction of samples.
+        wanted = fraction * self.count
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if (count > 0) and (seen >= wanted):
+                if index < len(self.bounds):
+                    return self.bounds[index]
+                return float('inf')
+        return 0.0
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+class LinkStats(object):
+    def __init__(self):
+        self.latency = {}
+        self.addresses = {}
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.executing = 0.0
+
+    def record(self, kind, offset, count, seconds, failed, attempt):
+        if kind not in self.latency:
+            self.latency[kind] = Histogram()
+        self.latency[kind].add(seconds)
+        for address in xrange(offset, offset + count):
+            self.addresses[address] = self.addresses.get(address, 0) + 1
+        self.requests += 1
+        self.executing += seconds
+        if failed:
+            self.errors += 1
+        if attempt > 0:
+            self.retries += 1
+
+    def summary(self):
+        lines = ['%d requests, %d errors, %d retries, %.3f s executing'
+                 % (self.requests, self.errors, self.retries, self.executing)]
+        for kind in sorted(self.latency):
+            histogram = self.latency[kind]
+            lines.append('%-12s %6d x %8.2f ms mean, p50 <= %g ms, p99 <= %g ms'
+                         % (kind, histogram.count, histogram.mean() * 1000,
+                            histogram.percentile(0.50) * 1000,
+                            histogram.percentile(0.99) * 1000))
+        return '\n'.join(lines)
+
+tracers = []
+
+def traced(name):
+    # Decorate a device method so installed tracers see each call.
+    def decorate(method):
+        def call(*args, **kwargs):
+            if not tracers:
+                return method(*args, **kwargs)
+            with nested(*[tracer(name) for tracer in tracers]):
+                return method(*args, **kwargs)
+        call.__name__ = method.__name__
+        call.__doc__ = method.__doc__
+        return call
+    return decorate
+
+class TimingTracer(object):
+    # Accumulates call counts and wall time for each operation.
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+
+    @contextmanager
+    def __call__(self, name):
+        t1 = time()
+        try:
+            yield
+        finally:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + (time() - t1)
+
+    def summary(self):
+        return '\n'.join(['%-20s %6d x %10.3f s' % (name, self.calls[name], self.seconds[name])
+                          for name in sorted(self.calls)])
@@ -24,39 +24,130 @@
 
 import struct
 
-from tools import report
+from contextlib import contextmanager
+from time import time
+
+import threading
+
+from tools import warn
 
 from pymodbus.client.sync import ModbusTcpClient
 from pymodbus.constants import Defaults
+from pymodbus.pdu import ExceptionResponse
 
 from pymodbus.register_read_message import ReadInputRegistersRequest
 from pymodbus.register_write_message import WriteSingleRegisterRequest
+from pymodbus.register_write_message import WriteMultipleRegistersRequest
+
+# Most registers a single Modbus read request may return.
+MAX_READ_COUNT = 125
+
+# Most registers a single Modbus write request may carry.
+MAX_WRITE_COUNT = 123
+
+# Longest run of unwanted addresses worth reading to save a request.
+MAX_READ_GAP = 8
+
+# How block writes are verified: not at all, by checking the echoed
+# address and count, or by reading the whole block back once.
+VERIFY_NONE = 'none'
+VERIFY_ECHO = 'echo'
+VERIFY_READ = 'read'
+
+VERIFY_MODES = [VERIFY_NONE, VERIFY_ECHO, VERIFY_READ]
+
+def planBlocks(offsets, maxGap=MAX_READ_GAP, maxCount=MAX_READ_COUNT):
+    # Merge sorted unique addresses into (start, count) spans,
+    # bridging small gaps rather than issuing separate requests.
+    blocks = []
+    for offset in sorted(set(map(long, offsets))):
+        if blocks:
+            start, count = blocks[-1]
+            end = start + count
+            if (offset - end <= maxGap) and (offset - start < maxCount):
+                blocks[-1] = (start, offset - start + 1)
+                continue
+        blocks.append((offset, 1L))
+    return blocks
 
 class ControlLink(object):
-    def __init__(self, host, port=Defaults.Port):
-        self.conn = ModbusTcpClient(host, port)
+    def __init__(self, host, port=Defaults.Port, verify=VERIFY_READ,
+                 retries=0, stats=None, conn=None, shadowAge=0.0):
+        if verify not in VERIFY_MODES:
+            raise ValueError('Unknown verify mode %s' % repr(verify))
+        self.verify = verify
+        self.retries = int(retries)
+        self.stats = stats
+        self.shadowAge = float(shadowAge)
+        self.banks = {}
+        self.open(host, port, conn)
+
+    def open(self, host, port, conn):
+        # Any object with connect() and execute(req) may stand in for
+        # the Modbus client, such as a recorded trace.
+        self.conn = conn or ModbusTcpClient(host, port)
         if not self.conn.connect():
             raise RuntimeError('Could not connect to host %s port %d' % (host, port))
 
+    def bank(self, offset):
+        # One shared shadow per control word.
+        offset = long(offset)
+        if offset not in self.banks:
+            self.banks[offset] = BitBank(self, offset, self.shadowAge)
+        return self.banks[offset]
+
+    @contextmanager
+    def urgent(self):
+        # Requests made inside are sent ahead of any others queued
+        # by other threads, on links that queue requests.
+        yield
+
     def read(self, offset):
+        return self.read_block(offset, 1)[0]
+
+    def read_block(self, start, count):
+        values = []
+        while count > 0:
+            part = min(count, MAX_READ_COUNT)
+            values.extend(self._readBlock(start, part))
+            start += part
+            count -= part
+        return values
+
+    def read_fresh(self, start, count):
+        # Read words about to be modified and written back, which must
+        # come from the device rather than any copy kept by the link.
+        return self.read_block(start, count)
+
+    def read_many(self, offsets, maxGap=MAX_READ_GAP):
+        # Read every block once, then pick out requested addresses.
+        words = {}
+        for (start, count) in planBlocks(offsets, maxGap):
+            block = self.read_block(start, count)
+            for (index, value) in enumerate(block):
+                words[start + index] = value
+        return [words[long(offset)] for offset in offsets]
+
+    def _readBlock(self, offset, count):
         # Adjust offset due to weirdness.
         offset -= 40000
 
         # Create request.
         assert offset is not None
         assert offset >= 0
-        req = ReadInputRegistersRequest(offset, 1)
+        assert 0 < count <= MAX_READ_COUNT
+        req = ReadInputRegistersRequest(offset, count)
         assert req is not None
 
         # Execute and return response.
-        res = self.conn.execute(req)
+        res = self._execute('read', req, offset + 40000, count)
         assert res is not None
 
-        # Extract single value from response.
+        # Extract values from response.
         values = res.registers
         assert values is not None
-        assert len(values) == 1
-        return long(values[0])
+        assert len(values) == count
+        return map(long, values)
 
     def write(self, offset, value):
         # Adjust offset due to weirdness.
@@ -69,43 +160,258 @@ class ControlLink(object):
         req = WriteSingleRegisterRequest(offset, value)
 
         # Execute and return response.
-        res = self.conn.execute(req)
+        res = self._execute('write', req, offset + 40000, 1)
         assert res is not None
         assert res.value is not None
         nvalue = res.value
         if nvalue != value:
-            report('address %d, wrote %d, returned %d'
-                   % (offset, value, nvalue))
+            warn('address %d, wrote %d, returned %d', offset, value, nvalue)
         return nvalue
 
+    def _execute(self, kind, req, offset, count):
+        # Execute a request, retrying failures and recording statistics.
+        attempt = 0
+        while True:
+            t1 = time()
+            try:
+                res = self.conn.execute(req)
+                failed = (res is None) or isinstance(res, ExceptionResponse)
+            except Exception:
+                res = None
+                failed = True
+                if attempt >= self.retries:
+                    if self.stats is not None:
+                        self.stats.record(kind, offset, count, time() - t1, True, attempt)
+                    raise
+            if self.stats is not None:
+                self.stats.record(kind, offset, count, time() - t1, failed, attempt)
+            if (not failed) or (attempt >= self.retries):
+                return res
+            attempt += 1
+            warn('%s at address %d failed, retry %d of %d',
+                 kind, offset, attempt, self.retries)
+
+    def write_block(self, start, values):
+        values = map(long, values)
+        offset = start
+        remain = values
+        while remain:
+            self._writeBlock(offset, remain[:MAX_WRITE_COUNT])
+            offset += len(remain[:MAX_WRITE_COUNT])
+            remain = remain[MAX_WRITE_COUNT:]
+
+        # Verify written values, returning what the device holds.
+        if self.verify != VERIFY_READ:
+            return values
+        nvalues = self.read_block(start, len(values))
+        if nvalues != values:
+            warn('addresses %d+%d, wrote %r, returned %r',
+                 start, len(values), values, nvalues)
+        return nvalues
+
+    def write_many(self, offsets, values):
+        # Write each contiguous run of addresses as one block.
+        words = dict(zip(map(long, offsets), map(long, values)))
+        for (start, count) in planBlocks(offsets, 0, MAX_WRITE_COUNT):
+            block = [words[start + index] for index in xrange(count)]
+            self._writeBlock(start, block)
+
+        # Verify written values with as few reads as possible.
+        values = [words[long(offset)] for offset in offsets]
+        if self.verify != VERIFY_READ:
+            return values
+        nvalues = self.read_many(offsets)
+        if nvalues != values:
+            warn('addresses %r, wrote %r, returned %r', offsets, values, nvalues)
+        return nvalues
+
+    def _writeBlock(self, offset, values):
+        # Adjust offset due to weirdness.
+        offset -= 40000
+
+        # Create request.
+        assert offset is not None
+        assert offset >= 0
+        assert 0 < len(values) <= MAX_WRITE_COUNT
+        req = WriteMultipleRegistersRequest(offset, values)
+
+        # Execute and check echoed response.
+        res = self._execute('write_block', req, offset + 40000, len(values))
+        assert res is not None
+        if self.verify == VERIFY_NONE:
+            return
+        if (res.address != offset) or (res.count != len(values)):
+            warn('address %d+%d, echoed %r+%r',
+                 offset, len(values), res.address, res.count)
+
+def readRegisters(link, registers, maxGap=MAX_READ_GAP):
+    # Read several registers with as few requests as possible.
+    offsets = []
+    for register in registers:
+        offsets.extend(register.addresses())
+    words = link.read_many(offsets, maxGap)
+
+    values = []
+    for register in registers:
+        width = len(register.addresses())
+        values.append(register.decode(words[:width]))
+        words = words[width:]
+    return values
+
 class IntegerRegister(object):
     def __init__(self, link, offset):
         self.link = link
         self.offset = long(offset)
 
+    def addresses(self):
+        return [self.offset]
+
+    def decode(self, words):
+        return words[0]
+
+    def encode(self, value):
+        return [long(value)]
+
     def read(self):
         return self.link.read(self.offset)
 
     def write(self, value):
         return self.link.write(self.offset, value)
 
+class BitBank(object):
+    # Control word shared by several toggle registers. Bit changes are
+    # merged with the current word and written in one request.
+    #
+    # The word is read before every write unless it was read or written
+    # less than maxAge seconds ago. Another client may change other bits
+    # of the word meanwhile, so a nonzero maxAge is only safe for a link
+    # that has the controller to itself. Status bits belong to the device
+    # and are never written back from an old copy.
+    def __init__(self, link, offset, maxAge=0.0):
+        self.link = link
+        self.offset = long(offset)
+        self.maxAge = float(maxAge)
+        self.word = None
+        self.taken = 0.0
+        self.statusMask = 0
+        self.setMask = 0
+        self.clearMask = 0
+        self.depth = 0
+        self.lock = threading.RLock()
+
+    def invalidate(self):
+        self.word = None
+
+    def isStale(self):
+        return (self.word is None) or ((time() - self.taken) >= self.maxAge)
+
+    def read(self):
+        # Status bits change on the device, so never reuse the shadow.
+        self.word = int(self.link.read(self.offset))
+        self.taken = time()
+        return self.word
+
+    def readFresh(self):
+        # The word about to be written back, read from the device.
+        self.word = int(self.link.read_fresh(self.offset, 1)[0])
+        self.taken = time()
+        return self.word
+
+    def stage(self, mask, state):
+        # Threads sharing a link may change bits of the same word.
+        with self.lock:
+            if state:
+                self.setMask |= mask
+                self.clearMask &= ~mask
+            else:
+                self.clearMask |= mask
+                self.setMask &= ~mask
+            if self.depth == 0:
+                return self.flush()
+
+    def flush(self):
+        with self.lock:
+            if (self.setMask == 0) and (self.clearMask == 0):
+                return self.word
+            try:
+                if self.isStale():
+                    word = self.readFresh()
+                else:
+                    word = self.word & ~self.statusMask
+                word = (word & ~self.clearMask) | self.setMask
+                self.setMask = 0
+                self.clearMask = 0
+                nword = int(self.link.write(self.offset, word))
+            except:
+                self.invalidate()
+                raise
+            # Trust the echo only if it matches what was written.
+            self.word = nword if (nword == word) else None
+            self.taken = time()
+            return nword
+
+    @contextmanager
+    def batch(self):
+        # Hold staged bits until the outermost batch ends. Other threads
+        # wait to change bits of this word until then.
+        with self.lock:
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+            if self.depth == 0:
+                self.flush()
+
+@contextmanager
+def batchBits(*registers):
+    # Merge writes to toggle registers into one write per control word.
+    # Banks are locked in address order so batches cannot deadlock.
+    banks = []
+    for register in registers:
+        if register.bank not in banks:
+            banks.append(register.bank)
+    banks.sort(key=lambda bank: (bank.offset, id(bank)))
+    for bank in banks:
+        bank.lock.acquire()
+    try:
+        for bank in banks:
+            bank.depth += 1
+        try:
+            yield
+        finally:
+            for bank in banks:
+                bank.depth -= 1
+        for bank in banks:
+            if bank.depth == 0:
+                bank.flush()
+    finally:
+        for bank in reversed(banks):
+            bank.lock.release()
+
 class ToggleRegister(object):
-    def __init__(self, link, (offset, bit)):
+    # A status register reports a bit set by the device.
+    def __init__(self, link, (offset, bit), status=False):
         self.link = link
         self.offset = long(offset)
         self.bit = int(bit)
         self.mask = int(1) << int(bit)
+        self.bank = link.bank(self.offset)
+        if status:
+            self.bank.statusMask |= self.mask
 
-    def read(self):
-        word = int(self.link.read(self.offset))
-        state = (word >> self.bit) & int(1)
+    def addresses(self):
+        return [self.offset]
+
+    def decode(self, words):
+        state = (int(words[0]) >> self.bit) & int(1)
         return (state != 0)
 
+    def read(self):
+        return self.decode([self.bank.read()])
+
     def write(self, state):
-        word = int(self.link.read(self.offset))
-        word &= ~self.mask
-        if state: word |= self.mask
-        return self.link.write(self.offset, word)
+        return self.bank.stage(self.mask, state)
 
 class MultiIntegerRegister(object):
     def __init__(self, link, offsets, eachWidth):
@@ -114,32 +420,39 @@ class MultiIntegerRegister(object):
         self.eachWidth = long(eachWidth)
         self.mask = (1L << self.eachWidth) - 1L
 
-    def read(self):
+    def addresses(self):
+        return list(self.offsets)
+
+    def decode(self, words):
         value = 0L
         shift = 0L
-        for offset in self.offsets:
-            part = self.link.read(offset)
-
+        for (offset, part) in zip(self.offsets, words):
             if (part & self.mask) != part:
-                report('address %ld has value %ld too large for %ld bits'
-                       % (offset, part, self.eachWidth))
+                warn('address %ld has value %ld too large for %ld bits',
+                     offset, part, self.eachWidth)
 
             part <<= shift
             shift += self.eachWidth
             value |= part
         return value
 
-    def write(self, value):
+    def read(self):
+        return self.decode(self.link.read_many(self.offsets))
+
+    def encode(self, value):
         nvalue = long(value)
+        words = []
         for offset in self.offsets:
-            part = nvalue & self.mask
+            words.append(nvalue & self.mask)
             nvalue >>= self.eachWidth
-            self.link.write(offset, part)
         assert nvalue == 0
-        nvalue = self.read()
-        if nvalue != value:
-            report('addresses [%s], wrote %ld, returned %ld'
-                   % (', '.join(map(str, self.offsets)), value, nvalue))
+        return words
+
+    def write(self, value):
+        words = self.link.write_many(self.offsets, self.encode(value))
+        nvalue = self.decode(words)
+        if (self.link.verify == VERIFY_READ) and (nvalue != self.decode(self.encode(value))):
+            warn('addresses %r, wrote %ld, returned %ld', self.offsets, value, nvalue)
         return nvalue
 
 class FloatRegister(object): # 32-bits, taking up two full addresses
@@ -147,28 +460,34 @@ class FloatRegister(object): # 32-bits, taking up two full addresses
         self.link = link
         self.offset = long(offset)
 
-    def read(self):
-        # Read individual 16 bit unsigned integers
-        lo = self.link.read(self.offset + 0)
-        hi = self.link.read(self.offset + 1)
+    def addresses(self):
+        return [self.offset + 0, self.offset + 1]
+
+    def decode(self, words):
+        lo, hi = words
         # Pack into bytes as 2 x 16 bit unsigned integers
         data = struct.pack('>HH', lo, hi)
         # Unpack from bytes as 1 x 32 bit float
         return struct.unpack('>f', data)[0]
 
-    def write(self, value):
+    def read(self):
+        # Read both 16 bit unsigned integers in one request
+        return self.decode(self.link.read_block(self.offset, 2))
+
+    def encode(self, value):
         # Pack into bytes as 1 x 32 bit float
         data = struct.pack('>f', value)
         # Unpack from bytes as 2 x 16 bit unsigned integers
         lo, hi = struct.unpack('>HH', data)
-        # Write individual 16 bit unsigned integers
-        self.link.write(self.offset + 0, lo)
-        self.link.write(self.offset + 1, hi)
-        # Verify written value
-        nvalue = self.read()
-        if nvalue != value:
-            report('address %ld float, wrote %f, returned %f'
-                   % (self.offset, value, nvalue))
+        return [lo, hi]
+
+    def write(self, value):
+        # Write both 16 bit unsigned integers in one request
+        words = self.link.write_block(self.offset, self.encode(value))
+        # Verify written value, as rounded to 32 bits
+        nvalue = self.decode(words)
+        if (self.link.verify == VERIFY_READ) and (nvalue != self.decode(self.encode(value))):
+            warn('address %ld float, wrote %f, returned %f', self.offset, value, nvalue)
         return nvalue
 
 class DwordRegister(object): # 32-bits, taking up two full addresses
@@ -176,26 +495,32 @@ class DwordRegister(object): # 32-bits, taking up two full addresses
         self.link = link
         self.offset = long(offset)
 
-    def read(self):
-        # Read individual 16 bit unsigned integers
-        lo = self.link.read(self.offset + 0)
-        hi = self.link.read(self.offset + 1)
+    def addresses(self):
+        return [self.offset + 0, self.offset + 1]
+
+    def decode(self, words):
+        lo, hi = words
         # Pack into bytes as 2 x 16 bit unsigned integers
         data = struct.pack('>HH', lo, hi)
         # Unpack from bytes as 1 x 32 bit integer
         return struct.unpack('>I', data)[0]
 
-    def write(self, value):
+    def read(self):
+        # Read both 16 bit unsigned integers in one request
+        return self.decode(self.link.read_block(self.offset, 2))
+
+    def encode(self, value):
         # Pack into bytes as 1 x 32 bit integer
         data = struct.pack('>I', value)
         # Unpack from bytes as 2 x 16 bit unsigned integers
         lo, hi = struct.unpack('>HH', data)
-        # Write individual 16 bit unsigned integers
-        self.link.write(self.offset + 0, lo)
-        self.link.write(self.offset + 1, hi)
-        # Verify written value
-        nvalue = self.read()
-        if nvalue != value:
-            report('address %ld dword, wrote %ld, returned %ld'
-                   % (self.offset, value, nvalue))
+        return [lo, hi]
+
+    def write(self, value):
+        # Write both 16 bit unsigned integers in one request
+        words = self.link.write_block(self.offset, self.encode(value))
+        # Verify written value, as truncated to 32 bits
+        nvalue = self.decode(words)
+        if (self.link.verify == VERIFY_READ) and (nvalue != self.decode(self.encode(value))):
+            warn('address %ld dword, wrote %ld, returned %ld', self.offset, value, nvalue)
         return nvalue
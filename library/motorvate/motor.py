@@ -22,49 +22,188 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from link import ToggleRegister, FloatRegister
-from tools import report
+from link import ToggleRegister, FloatRegister, batchBits, readRegisters
+from link import MAX_READ_COUNT
+from instrument import traced
+from tools import debug, report
+from waits import AdaptiveWait
 
-from time import sleep
+from time import time, sleep
 
 class Motor(object):
     def __init__(self, link, aSwitch, aHome, aMove, aMoving, aPos):
-        report("Motor(aSwitch=%s, aHome=%s, aMove=%s, aMoving=%s, aPos=%s)" %
-               (repr(aSwitch), repr(aHome), repr(aMove), repr(aMoving), repr(aPos)))
+        debug("Motor(aSwitch=%r, aHome=%r, aMove=%r, aMoving=%r, aPos=%r)",
+              aSwitch, aHome, aMove, aMoving, aPos)
 
         # Create registers for each control address.
+        self.link = link
         self.rSwitch = ToggleRegister(link, aSwitch)
         self.rHome   = ToggleRegister(link, aHome)
         self.rMove   = ToggleRegister(link, aMove)
-        self.rMoving = ToggleRegister(link, aMoving)
+        self.rMoving = ToggleRegister(link, aMoving, status=True)
         self.rPos    =  FloatRegister(link, aPos)
 
+        # Strategy for polling until motion completes.
+        self.waits = AdaptiveWait()
+
+        # Velocity model, learned from completed moves.
+        self.position = None
+        self.speed = None
+        self.started = None
+        self.target = None
+
+        # Commanded state, trusted only while status reads agree: left
+        # enabled with home and move clear, last setpoint as the device
+        # holds it, and whether the axis has been homed without moving
+        # since.
+        self.idle = False
+        self.setpoint = None
+        self.homed = False
+
     # Homing logic.
 
+    @traced('Motor.home')
     def home(self):
         report("Motor.home()")
-        self.rSwitch.write(True)
-        self.rHome.write(False)
-        self.rMove.write(False)
-        self.rHome.write(True)
+        if not self.startHome():
+            return
+        delays = self.waits.begin()
         while self.isMoving():
-            sleep(0.1)
+            sleep(delays.next())
+        self.finishHome()
+
+    def homeTask(self):
+        report("Motor.homeTask()")
+        if not self.startHome():
+            return
+        delays = self.waits.begin()
+        while self.isMoving():
+            yield delays.next()
+        self.finishHome()
+
+    def startHome(self):
+        # Returns False if the axis is already homed and idle.
+        settled = self.confirmIdle()
+        if settled and self.homed:
+            debug("Motor.home() already homed")
+            return False
+        if not settled:
+            with batchBits(self.rSwitch, self.rHome, self.rMove):
+                self.rSwitch.write(True)
+                self.rHome.write(False)
+                self.rMove.write(False)
+        self.rHome.write(True)
+        self.idle = False
+        return True
+
+    def finishHome(self):
         self.rHome.write(False)
+        self.position = None
+        self.idle = True
+        self.homed = True
 
     # Moving logic.
 
+    @traced('Motor.move')
     def move(self, position):
-        report("Motor.move(%s)" % repr(position))
-        self.rSwitch.write(True)
-        self.rHome.write(False)
-        self.rMove.write(False)
-        self.rPos.write(float(position))
-        self.rMove.write(True)
+        report("Motor.move(%r)", position)
+        delays = self.waits.begin(self.expectMove(position))
+        if not self.startMove(position):
+            return
+        while self.isMoving():
+            sleep(delays.next())
+        self.finishMove()
+
+    def moveTask(self, position):
+        report("Motor.moveTask(%r)", position)
+        delays = self.waits.begin(self.expectMove(position))
+        if not self.startMove(position):
+            return
         while self.isMoving():
-            sleep(0.1)
+            yield delays.next()
+        self.finishMove()
+
+    def startMove(self, position):
+        # Returns False if the axis is already idle at this position.
+        position = float(position)
+        settled = self.confirmIdle()
+        if settled and (self.position == position):
+            debug("Motor.move(%r) already there", position)
+            return False
+        if not settled:
+            with batchBits(self.rSwitch, self.rHome, self.rMove):
+                self.rSwitch.write(True)
+                self.rHome.write(False)
+                self.rMove.write(False)
+        rounded = self.rPos.decode(self.rPos.encode(position))
+        if self.setpoint != rounded:
+            nvalue = self.rPos.write(position)
+            if nvalue == rounded:
+                self.setpoint = rounded
+            else:
+                self.setpoint = None
+        self.rMove.write(True)
+        self.idle = False
+        self.homed = False
+        self.started = time()
+        self.target = position
+        return True
+
+    def finishMove(self, stopped=None):
+        if self.started is None:
+            # Nothing was commanded.
+            return
         self.rMove.write(False)
+        if stopped is None:
+            stopped = time()
+
+        # Update the velocity model from the observed travel time.
+        if self.position is not None:
+            distance = abs(self.target - self.position)
+            taken = stopped - self.started
+            if (distance > 0) and (taken > 0):
+                speed = distance / taken
+                if self.speed is not None:
+                    speed = (self.speed + speed) / 2.0
+                self.speed = speed
+        self.position = self.target
+        self.started = None
+        self.idle = True
+
+    def confirmIdle(self):
+        # One status read to check the tracked state still holds. Any
+        # move by another client changes the setpoint words, so they
+        # are read too; if anything disagrees, forget everything tracked
+        # except the setpoint just read. A home or a move to the same
+        # setpoint by another client cannot be seen in this map, so
+        # clients sharing an axis should go through one daemon.
+        if not self.idle:
+            self.setpoint = None
+            return False
+        values = readRegisters(self.link,
+            [self.rSwitch, self.rHome, self.rMove, self.rMoving, self.rPos],
+            MAX_READ_COUNT)
+        bits, setpoint = values[:4], values[4]
+        if (bits == [True, False, False, False]) and (setpoint == self.setpoint):
+            return True
+        debug("Motor state disagrees with status %r, setpoint %r", bits, setpoint)
+        self.forget()
+        self.setpoint = setpoint
+        return False
+
+    def forget(self):
+        self.idle = False
+        self.homed = False
+        self.setpoint = None
+        self.position = None
+
+    def expectMove(self, position):
+        # Predicted travel time in seconds, or None if not yet known.
+        if (self.position is None) or (self.speed is None):
+            return None
+        return abs(float(position) - self.position) / self.speed
 
     def isMoving(self):
         moving = self.rMoving.read()
-        report("Motor.isMoving() -> %s" % repr(moving))
+        debug("Motor.isMoving() -> %r", moving)
         return moving
@@ -0,0 +1,329 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Pipelined Modbus TCP link keeping several requests in flight.
+#
+# Requests are framed directly on a small pool of sockets and matched
+# to their responses by transaction id, so a window of requests per
+# connection can overlap on the wire. The *_async methods return
+# futures; the ControlLink methods wait on them, and read_many issues
+# all of its blocks before waiting on any.
+
+from link import ControlLink, planBlocks, VERIFY_READ
+from link import VERIFY_NONE, MAX_READ_COUNT, MAX_READ_GAP
+from tools import debug, warn
+
+from pymodbus.constants import Defaults
+
+from time import time
+
+import socket
+import struct
+import threading
+
+# Longest wait for any response, in seconds.
+DEFAULT_TIMEOUT = 10.0
+
+class Future(object):
+    def __init__(self, convert=None):
+        self.convert = convert
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.onCancel = None
+
+    def set(self, value):
+        try:
+            if self.convert is not None:
+                value = self.convert(value)
+            self.value = value
+        except Exception, error:
+            self.error = error
+        self.event.set()
+
+    def fail(self, error):
+        self.error = error
+        self.event.set()
+
+    def done(self):
+        return self.event.isSet()
+
+    def cancel(self):
+        # Stop waiting, releasing whatever the request holds.
+        if (self.onCancel is not None) and (not self.done()):
+            self.onCancel()
+
+    def result(self, timeout=DEFAULT_TIMEOUT):
+        self.event.wait(timeout)
+        if not self.event.isSet():
+            self.cancel()
+            raise RuntimeError('No response after %.1f s' % timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class Joined(object):
+    # Future combining the results of several others.
+    def __init__(self, parts, combine):
+        self.parts = parts
+        self.combine = combine
+
+    def done(self):
+        return all([part.done() for part in self.parts])
+
+    def cancel(self):
+        for part in self.parts:
+            part.cancel()
+
+    def result(self, timeout=DEFAULT_TIMEOUT):
+        try:
+            return self.combine([part.result(timeout) for part in self.parts])
+        except:
+            self.cancel()
+            raise
+
+class PipelineConnection(object):
+    def __init__(self, host, port, window, stats=None, timeout=DEFAULT_TIMEOUT):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timeout = float(timeout)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.free = int(window)
+        self.closed = False
+        self.pending = {}
+        self.dropped = set()
+        self.nextId = 0
+        self.stats = stats
+        self.reader = threading.Thread(target=self.receiveAll)
+        self.reader.setDaemon(True)
+        self.reader.start()
+
+    def submit(self, pdu, future, kind, offset, count):
+        # Wait while the window is full, then send without waiting.
+        self.lock.acquire()
+        try:
+            deadline = time() + self.timeout
+            while (self.free == 0) and (not self.closed):
+                remaining = deadline - time()
+                if remaining <= 0:
+                    future.fail(RuntimeError('No window after %.1f s' % self.timeout))
+                    return future
+                self.ready.wait(remaining)
+            if self.closed:
+                future.fail(RuntimeError('Connection closed'))
+                return future
+
+            self.free -= 1
+            tid = self.nextId
+            self.nextId = (self.nextId + 1) & 0xFFFF
+            self.dropped.discard(tid)
+            self.pending[tid] = (future, kind, offset, count, time())
+            future.onCancel = lambda: self.drop(tid)
+            frame = struct.pack('>HHHB', tid, 0, len(pdu) + 1, Defaults.UnitId) + pdu
+            try:
+                self.sock.sendall(frame)
+            except socket.error, error:
+                # The reader fails everything else once the socket closes.
+                del self.pending[tid]
+                self.free += 1
+                self.ready.notifyAll()
+                future.fail(RuntimeError('Connection closed: %s' % error))
+                self.sock.close()
+        finally:
+            self.lock.release()
+        return future
+
+    def drop(self, tid):
+        # Give up on a request: free its window slot now, and discard
+        # its response if it still arrives.
+        self.lock.acquire()
+        try:
+            if self.pending.pop(tid, None) is not None:
+                self.dropped.add(tid)
+                self.free += 1
+                self.ready.notify()
+        finally:
+            self.lock.release()
+
+    def receiveAll(self):
+        try:
+            while True:
+                header = receive(self.sock, 7)
+                if header is None:
+                    break
+                tid, protocol, length, unit = struct.unpack('>HHHB', header)
+                pdu = receive(self.sock, length - 1)
+                if pdu is None:
+                    break
+
+                self.lock.acquire()
+                try:
+                    entry = self.pending.pop(tid, None)
+                    if entry is not None:
+                        self.free += 1
+                        self.ready.notify()
+                    late = tid in self.dropped
+                    self.dropped.discard(tid)
+                finally:
+                    self.lock.release()
+                if entry is None:
+                    if late:
+                        debug('late response for dropped transaction id %d', tid)
+                    else:
+                        warn('unexpected transaction id %d', tid)
+                    continue
+
+                future, kind, offset, count, started = entry
+                failed = (ord(pdu[0]) & 0x80) != 0
+                if self.stats is not None:
+                    self.stats.record(kind, offset, count, time() - started, failed, 0)
+                if failed:
+                    future.fail(RuntimeError('%s at address %d failed with code %d'
+                                             % (kind, offset, ord(pdu[1]))))
+                else:
+                    future.set(pdu)
+        except socket.error:
+            pass
+
+        # Connection lost: fail everything still waiting, return their
+        # window slots and refuse further requests.
+        self.lock.acquire()
+        try:
+            self.closed = True
+            pending = self.pending.values()
+            self.free += len(pending)
+            self.pending.clear()
+            self.ready.notifyAll()
+        finally:
+            self.lock.release()
+        for entry in pending:
+            entry[0].fail(RuntimeError('Connection closed'))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        self.reader.join()
+
+class PipelinedLink(ControlLink):
+    def __init__(self, host, port=Defaults.Port, verify=VERIFY_READ,
+                 window=8, connections=1, stats=None, timeout=DEFAULT_TIMEOUT,
+                 **options):
+        self.window = int(window)
+        self.connections = int(connections)
+        self.timeout = float(timeout)
+        self.turn = 0
+        ControlLink.__init__(self, host, port, verify, stats=stats, **options)
+
+    def open(self, host, port, conn):
+        # Requests are framed here, so there is no Modbus client.
+        try:
+            self.pool = [PipelineConnection(host, port, self.window,
+                                            self.stats, self.timeout)
+                         for index in xrange(self.connections)]
+        except socket.error:
+            raise RuntimeError('Could not connect to host %s port %d' % (host, port))
+
+    def close(self):
+        for connection in self.pool:
+            connection.close()
+
+    def submit(self, pdu, convert, kind, offset, count):
+        # Spread requests over the pool in turn.
+        connection = self.pool[self.turn % len(self.pool)]
+        self.turn += 1
+        return connection.submit(pdu, Future(convert), kind, offset, count)
+
+    # Asynchronous requests.
+
+    def read_block_async(self, start, count):
+        parts = []
+        while count > 0:
+            part = min(count, MAX_READ_COUNT)
+            pdu = struct.pack('>BHH', 4, start - 40000, part)
+            parts.append(self.submit(pdu, decodeRead, 'read', start, part))
+            start += part
+            count -= part
+        return Joined(parts, lambda blocks: sum(blocks, []))
+
+    def read_many_async(self, offsets, maxGap=MAX_READ_GAP):
+        blocks = planBlocks(offsets, maxGap)
+        futures = [self.read_block_async(start, count) for (start, count) in blocks]
+
+        def combine(values):
+            words = {}
+            for ((start, count), block) in zip(blocks, values):
+                for (index, value) in enumerate(block):
+                    words[start + index] = value
+            return [words[long(offset)] for offset in offsets]
+        return Joined(futures, combine)
+
+    def write_async(self, offset, value):
+        pdu = struct.pack('>BHH', 6, offset - 40000, value)
+        return self.submit(pdu, decodeWrite, 'write', offset, 1)
+
+    def write_block_async(self, start, values):
+        values = map(long, values)
+        pdu = struct.pack('>BHHB%dH' % len(values), 16, start - 40000,
+                          len(values), 2 * len(values), *values)
+        return self.submit(pdu, decodeWrite, 'write_block', start, len(values))
+
+    # ControlLink requests, waiting on the futures.
+
+    def read_many(self, offsets, maxGap=MAX_READ_GAP):
+        return self.read_many_async(offsets, maxGap).result(self.timeout)
+
+    def _readBlock(self, offset, count):
+        return self.read_block_async(offset, count).result(self.timeout)
+
+    def write(self, offset, value):
+        nvalue = self.write_async(offset, value).result(self.timeout)
+        if nvalue != value:
+            warn('address %d, wrote %d, returned %d', offset, value, nvalue)
+        return nvalue
+
+    def _writeBlock(self, offset, values):
+        count = self.write_block_async(offset, values).result(self.timeout)
+        if (self.verify != VERIFY_NONE) and (count != len(values)):
+            warn('address %d+%d, echoed count %d', offset, len(values), count)
+
+def decodeRead(pdu):
+    size = ord(pdu[1])
+    return map(long, struct.unpack('>%dH' % (size // 2), pdu[2:2 + size]))
+
+def decodeWrite(pdu):
+    # Echoed value for a single write, or count for a block write.
+    return long(struct.unpack('>HH', pdu[1:5])[1])
+
+def receive(sock, size):
+    data = ''
+    while len(data) < size:
+        part = sock.recv(size - len(data))
+        if not part:
+            return None
+        data += part
+    return data
@@ -0,0 +1,129 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Ordering of multi-axis points to reduce total travel time.
+#
+# Axes move together, so travel between two points takes as long as the
+# slowest axis needs. A nearest-neighbour route is improved by 2-opt
+# segment reversals until no reversal shortens it.
+
+from tools import report
+
+def travelTime(a, b, speeds):
+    return max([abs(x - y) / speed for (x, y, speed) in zip(a, b, speeds)] or [0.0])
+
+def axisSpeeds(motors, default=1.0):
+    # Learned speed of each axis. An axis not yet measured is taken to
+    # be as slow as the slowest known one, so it cannot dominate the
+    # route cost; the default applies only when none is known.
+    speeds = [motor.speed for motor in motors]
+    known = [speed for speed in speeds if speed]
+    if known:
+        default = min(known)
+    return [speed or default for speed in speeds]
+
+def currentPosition(motors):
+    positions = [motor.position for motor in motors]
+    if None in positions:
+        return None
+    return tuple(positions)
+
+def routeTime(points, order, speeds, start=None):
+    total = 0.0
+    previous = start
+    for index in order:
+        if previous is not None:
+            total += travelTime(previous, points[index], speeds)
+        previous = points[index]
+    return total
+
+def nearestRoute(points, speeds, start=None):
+    remaining = range(len(points))
+    order = []
+    current = start
+    if current is None and remaining:
+        current = points[remaining.pop(0)]
+        order.append(0)
+    while remaining:
+        best = min(remaining, key=lambda index: travelTime(current, points[index], speeds))
+        remaining.remove(best)
+        order.append(best)
+        current = points[best]
+    return order
+
+def improveRoute(points, order, speeds, start=None, passes=100):
+    # Reverse segments while that shortens the open route.
+    order = list(order)
+    count = len(order)
+
+    def at(position):
+        if position < 0:
+            return start
+        if position >= count:
+            return None
+        return points[order[position]]
+
+    def cost(a, b):
+        if (a is None) or (b is None):
+            return 0.0
+        return travelTime(a, b, speeds)
+
+    for attempt in xrange(passes):
+        improved = False
+        for i in xrange(count - 1):
+            for j in xrange(i + 1, count):
+                before = at(i - 1)
+                after = at(j + 1)
+                delta = (cost(before, at(j)) + cost(at(i), after) -
+                         cost(before, at(i)) - cost(at(j), after))
+                if delta < -1e-12:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+        if not improved:
+            break
+    return order
+
+def planRoute(motors, points, speeds=None, start=None):
+    # Order in which to visit points, as indices into the given list.
+    points = [tuple(map(float, point)) for point in points]
+    if speeds is None:
+        speeds = axisSpeeds(motors)
+    if start is None:
+        start = currentPosition(motors)
+
+    order = improveRoute(points, nearestRoute(points, speeds, start), speeds, start)
+    report("planRoute: %d points, %.1f s -> %.1f s", len(points),
+           routeTime(points, range(len(points)), speeds, start),
+           routeTime(points, order, speeds, start))
+    return order
+
+def reorder(points, order):
+    return [points[index] for index in order]
+
+def restoreOrder(results, order):
+    # Put results measured in planned order back in original order.
+    restored = [None] * len(order)
+    for (result, index) in zip(results, order):
+        restored[index] = result
+    return restored
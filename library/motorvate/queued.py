@@ -0,0 +1,170 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Link shared safely between threads.
+#
+# Every request is handed to one I/O thread through a priority queue,
+# so a status thread and a scan thread can share one connection to the
+# controller. Requests made inside link.urgent(), such as stopping the
+# counters or disabling a relay, go ahead of everything else, and writes
+# go ahead of reads. A read of the same block as one still waiting in
+# the queue shares its response instead of being sent again. A request
+# whose callers all stop waiting is dropped if it has not been sent yet;
+# one already being sent still completes.
+
+from link import ControlLink, VERIFY_READ
+from pipeline import Future, DEFAULT_TIMEOUT
+
+from pymodbus.constants import Defaults
+
+from contextlib import contextmanager
+
+import itertools
+import threading
+import Queue
+
+PRIORITY_URGENT = 0
+PRIORITY_WRITE = 1
+PRIORITY_READ = 2
+PRIORITY_CLOSE = 3
+
+class QueuedRequest(object):
+    def __init__(self, key, kind, req, offset, count):
+        self.key = key
+        self.kind = kind
+        self.req = req
+        self.offset = offset
+        self.count = count
+        self.future = Future()
+        self.waiters = 0
+        self.started = False
+        self.cancelled = False
+
+class QueuedLink(ControlLink):
+    def __init__(self, host, port=Defaults.Port, verify=VERIFY_READ,
+                 timeout=DEFAULT_TIMEOUT, **options):
+        ControlLink.__init__(self, host, port, verify, **options)
+        self.timeout = float(timeout)
+        self.queue = Queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.coalesced = 0
+        self.worker = threading.Thread(target=self.serve)
+        self.worker.setDaemon(True)
+        self.worker.start()
+
+    def bank(self, offset):
+        self.lock.acquire()
+        try:
+            return ControlLink.bank(self, offset)
+        finally:
+            self.lock.release()
+
+    @contextmanager
+    def urgent(self):
+        previous = getattr(self.local, 'urgent', False)
+        self.local.urgent = True
+        try:
+            yield
+        finally:
+            self.local.urgent = previous
+
+    def priority(self, kind):
+        if getattr(self.local, 'urgent', False):
+            return PRIORITY_URGENT
+        if kind == 'read':
+            return PRIORITY_READ
+        return PRIORITY_WRITE
+
+    def _execute(self, kind, req, offset, count):
+        # Queue the request for the I/O thread and wait for it.
+        priority = self.priority(kind)
+        key = None
+        if kind == 'read':
+            key = (priority, offset, count)
+        self.lock.acquire()
+        try:
+            request = self.pending.get(key)
+            if request is not None:
+                self.coalesced += 1
+            else:
+                request = QueuedRequest(key, kind, req, offset, count)
+                if key is not None:
+                    self.pending[key] = request
+                self.queue.put((priority, self.sequence.next(), request))
+            request.waiters += 1
+        finally:
+            self.lock.release()
+
+        try:
+            return request.future.result(self.timeout)
+        finally:
+            if not request.future.done():
+                self.abandon(request)
+
+    def abandon(self, request):
+        # Drop a request nobody waits for any more, unless it is being sent.
+        self.lock.acquire()
+        try:
+            request.waiters -= 1
+            if (request.waiters == 0) and (not request.started):
+                request.cancelled = True
+                if self.pending.get(request.key) is request:
+                    del self.pending[request.key]
+        finally:
+            self.lock.release()
+
+    def serve(self):
+        while True:
+            priority, sequence, request = self.queue.get()
+            if priority == PRIORITY_CLOSE:
+                request.future.set(None)
+                break
+
+            # Later reads of this block must send a new request.
+            self.lock.acquire()
+            try:
+                if request.cancelled:
+                    continue
+                request.started = True
+                if self.pending.get(request.key) is request:
+                    del self.pending[request.key]
+            finally:
+                self.lock.release()
+
+            try:
+                request.future.set(ControlLink._execute(self, request.kind,
+                    request.req, request.offset, request.count))
+            except Exception, error:
+                request.future.fail(error)
+
+    def close(self):
+        # Finish queued requests, then stop the I/O thread.
+        request = QueuedRequest(None, None, None, None, None)
+        self.queue.put((PRIORITY_CLOSE, self.sequence.next(), request))
+        request.future.result(self.timeout)
+        self.worker.join()
+        self.conn.close()
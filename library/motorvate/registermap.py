@@ -0,0 +1,129 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Declarative register maps.
+#
+# A map is a list of devices, each a dict with a 'type' from
+# DEVICE_TYPES, an optional 'name', and one entry per field of that
+# type. Bit fields take [address, bit]; word fields take an address;
+# list fields take a list of addresses. Each field kind has a fixed
+# width in words. Maps can be loaded from JSON, and compile into the
+# fewest contiguous block reads that cover every address. Writes are
+# not planned here: the link merges contiguous words of one write, and
+# batchBits merges bits of one control word.
+
+from link import planBlocks, MAX_READ_COUNT
+
+import json
+import re
+
+# Width in words of each field kind.
+KINDS = {
+    'bit':     1,
+    'word':    1,
+    'float':   2,
+    'dword':   2,
+}
+
+# Fields of each device type, in constructor order.
+DEVICE_TYPES = {
+    'relay':    [('switch', 'bit')],
+    'analog':   [('value', 'float')],
+    'counters': [('switch', 'bit'), ('busy', 'bit'),
+                 ('time', 'float'), ('values', 'dword[]')],
+    'motor':    [('switch', 'bit'), ('home', 'bit'), ('move', 'bit'),
+                 ('moving', 'bit'), ('position', 'float')],
+}
+
+def loadMap(path):
+    stream = open(path)
+    try:
+        return checkMap(json.load(stream))
+    finally:
+        stream.close()
+
+def checkMap(devices, reserved=()):
+    # Names become attributes, so each must be a unique identifier not
+    # already taken by whatever the devices are bound to.
+    names = set()
+    for device in devices:
+        kind = device.get('type')
+        if kind not in DEVICE_TYPES:
+            raise ValueError('Unknown device type %r' % kind)
+        for (field, fieldKind) in DEVICE_TYPES[kind]:
+            if field not in device:
+                raise ValueError('%s %r has no %r' % (kind, device.get('name'), field))
+        name = device.get('name')
+        if not name:
+            continue
+        if (not re.match(r'^[A-Za-z][A-Za-z0-9_]*$', name)) or (name in reserved):
+            raise ValueError('%s name %r is not allowed' % (kind, name))
+        if name in names:
+            raise ValueError('%s name %r is used twice' % (kind, name))
+        names.add(name)
+    return devices
+
+def fieldArgument(device, field, kind):
+    # Value in the form the device constructor takes.
+    value = device[field]
+    if kind == 'bit':
+        return (long(value[0]), int(value[1]))
+    if kind.endswith('[]'):
+        return [long(address) for address in value]
+    return long(value)
+
+def deviceArguments(device):
+    return [fieldArgument(device, field, kind)
+            for (field, kind) in DEVICE_TYPES[device['type']]]
+
+def fieldAddresses(device, field, kind):
+    value = fieldArgument(device, field, kind)
+    if kind == 'bit':
+        return [value[0]]
+    if kind.endswith('[]'):
+        width = KINDS[kind[:-2]]
+        return [address + index for address in value for index in xrange(width)]
+    return [value + index for index in xrange(KINDS[kind])]
+
+def mapAddresses(devices):
+    addresses = set()
+    for device in devices:
+        for (field, kind) in DEVICE_TYPES[device['type']]:
+            addresses.update(fieldAddresses(device, field, kind))
+    return sorted(addresses)
+
+class ReadPlan(object):
+    # Fewest contiguous block reads covering every mapped address; any
+    # gap that fits in one request is cheaper to read than to skip.
+    def __init__(self, devices, maxGap=MAX_READ_COUNT):
+        self.addresses = mapAddresses(devices)
+        self.blocks = planBlocks(self.addresses, maxGap)
+
+    def read(self, link):
+        # Read every mapped word, one request per block.
+        words = {}
+        for (start, count) in self.blocks:
+            for (index, value) in enumerate(link.read_block(start, count)):
+                words[start + index] = value
+        return words
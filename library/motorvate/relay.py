@@ -23,17 +23,31 @@
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from link import ToggleRegister
-from tools import report
+from tasks import Result
+from instrument import traced
+from tools import debug, report
 
 class Relay(object):
     def __init__(self, link, aSwitch):
-        report("Relay(aSwitch=%s)" % repr(aSwitch))
+        debug("Relay(aSwitch=%r)", aSwitch)
+        self.link = link
         self.rSwitch = ToggleRegister(link, aSwitch)
 
+    @traced('Relay.enable')
     def enable(self):
         report("Relay.enable()")
         self.rSwitch.write(True)
 
+    @traced('Relay.disable')
     def disable(self):
         report("Relay.disable()")
-        self.rSwitch.write(False)
+        with self.link.urgent():
+            self.rSwitch.write(False)
+
+    def enableTask(self):
+        self.enable()
+        yield Result(None)
+
+    def disableTask(self):
+        self.disable()
+        yield Result(None)
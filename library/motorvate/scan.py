@@ -0,0 +1,218 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from world import longest
+from link import readRegisters
+from tools import report
+
+from collections import namedtuple
+from time import time, sleep
+
+# One measured point: its index in the point list, axis positions,
+# counter values, wall time counting started and real time counted.
+ScanPoint = namedtuple('ScanPoint', 'index position counts started taken_ms')
+
+# One fly-scan sample: wall time, estimated position, counter values.
+FlySample = namedtuple('FlySample', 'time position counts')
+
+# Counts accumulated while the axis crossed one position interval.
+FlyBin = namedtuple('FlyBin', 'low high counts taken_ms')
+
+# Counter preset for fly scans, long enough to outlast any single move.
+FLY_PRESET_MS = 3600 * 1000
+
+class StepScan(object):
+    # Moves the axes through a list of points and counts at each,
+    # yielding results as they arrive. Motion to the next point starts
+    # as soon as counting ends, so readout and recording of one point
+    # overlap travel to the next, and counting starts once axes settle.
+    def __init__(self, world, motors, points, time_ms):
+        self.world = world
+        self.motors = list(motors)
+        self.points = [self.normalise(point) for point in points]
+        self.time_ms = time_ms
+        self.started = None
+        self.finished = None
+        self.expected = None
+        self.done = 0
+
+    def normalise(self, point):
+        if not isinstance(point, (list, tuple)):
+            point = (point,)
+        assert len(point) == len(self.motors)
+        return tuple(map(float, point))
+
+    def __iter__(self):
+        report("StepScan(%d axes, %d points, %r ms)",
+               len(self.motors), len(self.points), self.time_ms)
+        if getattr(self.world, 'remote', False):
+            return self.remoteSteps()
+        return self.steps()
+
+    def remoteSteps(self):
+        # A daemon runs the whole scan itself, then returns every point.
+        self.started = time()
+        self.done = 0
+        try:
+            for point in self.world.step_scan(self.motors, self.points, self.time_ms):
+                self.done += 1
+                yield point
+        finally:
+            self.finished = time()
+
+    def steps(self):
+        counters = self.world.counters
+        self.started = time()
+        self.done = 0
+
+        if self.points:
+            self.startMove(self.points[0])
+        try:
+            for (index, point) in enumerate(self.points):
+                self.finishMove(point)
+
+                # Arm counters as soon as motion has settled.
+                t1 = counters.startMeasure(self.time_ms)
+                delays = counters.waits.begin(self.time_ms / 1000.0)
+                while counters.isBusy():
+                    sleep(delays.next())
+                taken_ms = int((time() - t1) * 1000)
+
+                # Start travelling before reading out this point.
+                if (index + 1) < len(self.points):
+                    self.startMove(self.points[index + 1])
+
+                counts = counters.getCounts()
+                self.done += 1
+                yield ScanPoint(index, point, counts, t1, taken_ms)
+        finally:
+            counters.stop()
+            counters.setTime(0)
+            self.finished = time()
+            report("StepScan: %d points in %.1f s (%.2f points/s)",
+                   self.done, self.finished - self.started, self.rate())
+
+    def startMove(self, point):
+        self.expected = longest([motor.expectMove(position)
+                                 for (motor, position) in zip(self.motors, point)])
+        for (motor, position) in zip(self.motors, point):
+            motor.startMove(position)
+
+    def finishMove(self, point):
+        stopped = self.world.waitMotors(self.motors, self.expected)
+        for motor in self.motors:
+            motor.finishMove(stopped[motor])
+
+    def rate(self):
+        # Achieved throughput in points per second.
+        end = self.finished or time()
+        if (self.started is None) or (end <= self.started):
+            return 0.0
+        return self.done / (end - self.started)
+
+class FlyScan(object):
+    # Commands one long move and samples the counters at a fixed rate
+    # while the axis travels, then bins the counts into equal position
+    # intervals. The map has no position readback, so each sample's
+    # position is interpolated from its time between the observed
+    # start and end of motion, assuming constant speed.
+    def __init__(self, world, motor, start, end, bins, interval=0.05):
+        self.world = world
+        self.motor = motor
+        self.start = float(start)
+        self.end = float(end)
+        self.bins = int(bins)
+        self.interval = float(interval)
+        self.samples = []
+
+    def run(self):
+        report("FlyScan(%r to %r, %d bins)", self.start, self.end, self.bins)
+        if getattr(self.world, 'remote', False):
+            # A daemon runs the scan itself; samples stay there.
+            return self.world.fly_scan(self.motor, self.start, self.end,
+                                       self.bins, self.interval)
+        counters = self.world.counters
+        self.motor.move(self.start)
+
+        # Count freely for the whole move.
+        counters.stop()
+        counters.setTime(FLY_PRESET_MS)
+        counters.start()
+        self.motor.startMove(self.end)
+        t0 = time()
+
+        # Sample counters and moving bit together on a fixed schedule.
+        registers = counters.rValues + [self.motor.rMoving]
+        raw = []
+        due = t0
+        now = t0
+        try:
+            while True:
+                words = readRegisters(self.world.link, registers)
+                now = time()
+                raw.append((now, words[:-1]))
+                if not words[-1]:
+                    break
+                due += self.interval
+                delay = due - time()
+                if delay > 0:
+                    sleep(delay)
+        finally:
+            self.motor.finishMove(now)
+            counters.stop()
+            counters.setTime(0)
+
+        # Interpolate positions between start and end of motion.
+        span = max(now - t0, 1e-9)
+        self.samples = [
+            FlySample(when, self.start + (self.end - self.start) *
+                      min(max((when - t0) / span, 0.0), 1.0), counts)
+            for (when, counts) in raw
+        ]
+        result = self.binSamples()
+        report("FlyScan: %d samples in %.1f s", len(self.samples), span)
+        return result
+
+    def binSamples(self):
+        low = min(self.start, self.end)
+        width = (max(self.start, self.end) - low) / self.bins
+        channels = len(self.samples[0].counts) if self.samples else 0
+        counts = [[0] * channels for index in xrange(self.bins)]
+        taken = [0.0] * self.bins
+
+        # Credit each interval between samples to the bin of its midpoint.
+        for (a, b) in zip(self.samples, self.samples[1:]):
+            middle = (a.position + b.position) / 2.0
+            if width > 0:
+                index = int((middle - low) / width)
+            else:
+                index = 0
+            index = min(max(index, 0), self.bins - 1)
+            for channel in xrange(channels):
+                counts[index][channel] += b.counts[channel] - a.counts[channel]
+            taken[index] += b.time - a.time
+
+        return [FlyBin(low + index * width, low + (index + 1) * width,
+                       counts[index], int(taken[index] * 1000))
+                for index in xrange(self.bins)]
@@ -0,0 +1,255 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Simulated controller implementing the World register map over Modbus
+# TCP, for testing and benchmarking without the instrument.
+#
+# Motors travel at a fixed speed towards their setpoint on a rising
+# move bit, or towards the home position on a rising home bit, with
+# the moving bit set meanwhile. Counters accumulate at fixed rates from
+# a rising start bit until the preset time has elapsed, with the busy
+# bit set meanwhile. Other words simply hold what was written.
+# Addresses on the wire are 40000 below the map, as ControlLink expects.
+
+from link import FloatRegister, DwordRegister
+from pipeline import receive
+from world import RC_BASE, COUNTER_START, COUNTER_BUSY
+from world import COUNTER_TIME, COUNTER_VALUES
+from world import MOTORS, MOTOR_ENABLE, MOTOR_MOVE, MOTOR_HOME, MOTOR_MOVING
+from tools import report
+
+from random import uniform
+from time import time, sleep
+
+import SocketServer
+import struct
+import threading
+
+class SimMotor(object):
+    def __init__(self, base, aPos, speed):
+        self.base = base
+        self.rPos = FloatRegister(None, aPos)
+        self.speed = float(speed)
+        self.position = 0.0
+        self.origin = 0.0
+        self.target = 0.0
+        self.started = None
+
+    def isMoving(self):
+        return self.started is not None
+
+    def start(self, target, now):
+        self.update(now)
+        self.origin = self.position
+        self.target = float(target)
+        self.started = now
+
+    def stop(self, now):
+        self.update(now)
+        self.started = None
+
+    def update(self, now):
+        if self.started is None:
+            return
+        distance = self.target - self.origin
+        travelled = self.speed * (now - self.started)
+        if travelled >= abs(distance):
+            self.position = self.target
+            self.started = None
+        elif distance > 0:
+            self.position = self.origin + travelled
+        else:
+            self.position = self.origin - travelled
+
+class Simulator(object):
+    def __init__(self, host='localhost', port=0, speed=1000.0,
+                 rates=(1000.0, 2000.0, 3000.0, 4000.0), home=0.0,
+                 latency=0.0, jitter=0.0):
+        self.host = host
+        self.port = port
+        self.rates = map(float, rates)
+        self.home = float(home)
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+
+        self.words = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+        self.motors = [SimMotor(base, aPos, speed) for (base, aPos) in MOTORS]
+        self.rTime = FloatRegister(None, COUNTER_TIME)
+        self.rValues = [DwordRegister(None, aValue) for aValue in COUNTER_VALUES]
+        self.counted = [0L] * len(self.rValues)
+        self.countStart = None
+        self.preset = 0.0
+
+        self.requests = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    # Server lifetime.
+
+    def start(self):
+        self.server = SimulatorServer((self.host, self.port), SimulatorHandler)
+        self.server.simulator = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        report("Simulator listening on %s port %d", self.host, self.port)
+        return self.port
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def delay(self):
+        delay = self.latency + uniform(0.0, self.jitter)
+        if delay > 0:
+            sleep(delay)
+
+    # Register access.
+
+    def getWord(self, offset):
+        return self.words.get(offset, 0L)
+
+    def setBit(self, offset, bit, state):
+        word = self.getWord(offset) & ~(1L << bit)
+        if state:
+            word |= (1L << bit)
+        self.words[offset] = word
+
+    def setWords(self, register, value):
+        for (offset, word) in zip(register.addresses(), register.encode(value)):
+            self.words[offset] = long(word)
+
+    def getValue(self, register):
+        return register.decode([self.getWord(offset) for offset in register.addresses()])
+
+    def read(self, offset, count):
+        self.update(time())
+        return [self.getWord(offset + index) for index in xrange(count)]
+
+    def write(self, offset, value):
+        now = time()
+        self.update(now)
+        old = self.getWord(offset)
+        self.words[offset] = long(value)
+
+        for motor in self.motors:
+            if offset != motor.base:
+                continue
+            # Status bit belongs to the device.
+            self.setBit(offset, MOTOR_MOVING, motor.isMoving())
+            enabled = (value >> MOTOR_ENABLE) & 1
+            if not enabled:
+                motor.stop(now)
+            elif rising(old, value, MOTOR_MOVE):
+                motor.start(self.getValue(motor.rPos), now)
+            elif rising(old, value, MOTOR_HOME):
+                motor.start(self.home, now)
+
+        if offset == RC_BASE:
+            self.setBit(offset, COUNTER_BUSY, self.countStart is not None)
+            if rising(old, value, COUNTER_START):
+                self.countStart = now
+                self.preset = self.getValue(self.rTime) / 1000.0
+                self.counted = [0L] * len(self.rValues)
+            elif falling(old, value, COUNTER_START):
+                self.countStart = None
+
+        self.update(now)
+
+    def update(self, now):
+        for motor in self.motors:
+            motor.update(now)
+            self.setBit(motor.base, MOTOR_MOVING, motor.isMoving())
+
+        if self.countStart is not None:
+            elapsed = now - self.countStart
+            if (self.preset > 0) and (elapsed >= self.preset):
+                elapsed = self.preset
+                self.countStart = None
+            self.counted = [long(rate * elapsed) & 0xFFFFFFFFL for rate in self.rates]
+        for (register, value) in zip(self.rValues, self.counted):
+            self.setWords(register, value)
+        self.setBit(RC_BASE, COUNTER_BUSY, self.countStart is not None)
+
+    # Modbus protocol data units.
+
+    def execute(self, pdu):
+        code = ord(pdu[0])
+        self.lock.acquire()
+        try:
+            if code in (3, 4):
+                offset, count = struct.unpack('>HH', pdu[1:5])
+                values = self.read(offset + 40000, count)
+                return struct.pack('>BB%dH' % count, code, 2 * count, *values)
+            if code == 6:
+                offset, value = struct.unpack('>HH', pdu[1:5])
+                self.write(offset + 40000, value)
+                return pdu[:5]
+            if code == 16:
+                offset, count = struct.unpack('>HH', pdu[1:5])
+                values = struct.unpack('>%dH' % count, pdu[6:6 + 2 * count])
+                for (index, value) in enumerate(values):
+                    self.write(offset + 40000 + index, value)
+                return struct.pack('>BHH', code, offset, count)
+            # Illegal function.
+            return struct.pack('>BB', code | 0x80, 1)
+        finally:
+            self.lock.release()
+
+def rising(old, new, bit):
+    return (not (old >> bit) & 1) and ((new >> bit) & 1)
+
+def falling(old, new, bit):
+    return rising(new, old, bit)
+
+class SimulatorServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class SimulatorHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        simulator = self.server.simulator
+        while True:
+            header = receive(self.request, 7)
+            if header is None:
+                return
+            tid, protocol, length, unit = struct.unpack('>HHHB', header)
+            pdu = receive(self.request, length - 1)
+            if pdu is None:
+                return
+
+            reply = simulator.execute(pdu)
+            simulator.delay()
+            data = struct.pack('>HHHB', tid, protocol, len(reply) + 1, unit) + reply
+            self.request.sendall(data)
+
+            simulator.requests += 1
+            simulator.bytesIn += len(header) + len(pdu)
+            simulator.bytesOut += len(data)
@@ -0,0 +1,155 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Compact storage for scan results in fixed-width typed columns.
+#
+# ResultTable keeps each column in an array in memory. ResultWriter
+# streams rows to a file instead, so long scans never sit in memory,
+# and ResultReader maps a finished or in-progress file without
+# reading it. A file is a small header followed by packed little-endian
+# records; its row count follows from its size, so the header is never
+# rewritten.
+#
+# Header: magic, column count, record size, then for each column a
+# 16 byte name and a struct/array type code.
+
+from array import array
+
+import mmap
+import struct
+
+MAGIC = 'MVSTORE1'
+
+HEADER = struct.Struct('<8sHH')
+COLUMN = struct.Struct('<16sc')
+
+# Matching numpy type names for each supported type code.
+NUMPY_TYPES = {'f': 'f4', 'd': 'f8', 'I': 'u4', 'i': 'i4', 'H': 'u2'}
+
+def scanColumns(axes=1, channels=4, positionType='d'):
+    # Columns for step scan points: positions, counts, start, real time.
+    columns  = [('position%d' % axis, positionType) for axis in xrange(axes)]
+    columns += [('count%d' % channel, 'I') for channel in xrange(channels)]
+    columns += [('time', 'd'), ('taken_ms', 'I')]
+    return columns
+
+def pointRow(point):
+    # Row for a ScanPoint in the layout of scanColumns.
+    return list(point.position) + list(point.counts) + [point.started, point.taken_ms]
+
+def recordFormat(columns):
+    return '<' + ''.join([code for (name, code) in columns])
+
+class ResultTable(object):
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.names = [name for (name, code) in self.columns]
+        self.arrays = [array(code) for (name, code) in self.columns]
+
+    def __len__(self):
+        return len(self.arrays[0])
+
+    def __getitem__(self, index):
+        return tuple([values[index] for values in self.arrays])
+
+    def append(self, row):
+        assert len(row) == len(self.arrays)
+        for (values, value) in zip(self.arrays, row):
+            values.append(value)
+
+    def column(self, name):
+        return self.arrays[self.names.index(name)]
+
+class ResultWriter(object):
+    def __init__(self, path, columns):
+        self.columns = list(columns)
+        self.record = struct.Struct(recordFormat(self.columns))
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, len(self.columns), self.record.size))
+        for (name, code) in self.columns:
+            assert len(name) <= 16
+            self.file.write(COLUMN.pack(name, code))
+        self.file.flush()
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, row):
+        # Flush each row so readers see it straight away.
+        self.file.write(self.record.pack(*row))
+        self.file.flush()
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+class ResultReader(object):
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        magic, count, size = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a result file' % path)
+
+        self.columns = []
+        for index in xrange(count):
+            name, code = COLUMN.unpack(self.file.read(COLUMN.size))
+            self.columns.append((name.rstrip('\0'), code))
+        self.names = [name for (name, code) in self.columns]
+
+        self.record = struct.Struct(recordFormat(self.columns))
+        assert self.record.size == size
+        self.offset = HEADER.size + COLUMN.size * count
+        self.map = None
+        self.refresh()
+
+    def refresh(self):
+        # Remap to pick up rows appended since opening.
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return (len(self.map) - self.offset) // self.record.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not (0 <= index < len(self)):
+            raise IndexError(index)
+        return self.record.unpack_from(self.map, self.offset + index * self.record.size)
+
+    def column(self, name):
+        index = self.names.index(name)
+        return array(self.columns[index][1],
+                     [self[row][index] for row in xrange(len(self))])
+
+    def dtype(self):
+        # Record layout for numpy.frombuffer(reader.map, reader.dtype(),
+        # offset=reader.offset), which views the rows without copying.
+        return [(name, '<' + NUMPY_TYPES[code]) for (name, code) in self.columns]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,75 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Cooperative tasks for overlapping device operations in one thread.
+#
+# A task is a generator. Yielding a number of seconds suspends it for
+# that long while other tasks run; yielding another task runs it to
+# completion and resumes with its result; yielding a Result ends the
+# task with that value. Requests on the link still block, but all the
+# waiting between them is shared.
+
+from heapq import heappush, heappop
+from time import time, sleep
+from types import GeneratorType
+
+from tools import debug
+
+class Result(object):
+    def __init__(self, value):
+        self.value = value
+
+def runTasks(tasks):
+    # Run tasks until all have finished, returning their results in order.
+    results = [None] * len(tasks)
+    queue = []
+    for (index, task) in enumerate(tasks):
+        heappush(queue, (0.0, index, [task], None))
+
+    while queue:
+        (wake, index, stack, value) = heappop(queue)
+        delay = wake - time()
+        if delay > 0:
+            sleep(delay)
+
+        try:
+            step = stack[-1].send(value)
+        except StopIteration:
+            step = Result(None)
+
+        if isinstance(step, GeneratorType):
+            # Run a nested task before resuming this one.
+            stack.append(step)
+            heappush(queue, (0.0, index, stack, None))
+        elif isinstance(step, Result):
+            stack.pop().close()
+            if stack:
+                heappush(queue, (0.0, index, stack, step.value))
+            else:
+                results[index] = step.value
+        else:
+            heappush(queue, (time() + float(step or 0.0), index, stack, None))
+
+    debug("runTasks() -> %r", results)
+    return results
@@ -22,7 +22,67 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+# Leveled logging for the library.
+#
+# Messages are formatted only when their level is enabled, so pass
+# arguments separately rather than formatting them at the call site.
+# Routine polling is logged at debug level; XRD_LOG sets the level
+# printed to stderr (default INFO). A RingHandler can also keep the
+# most recent records in memory, unformatted, to dump after an error.
+
+from collections import deque
+
+import logging
+import os
 import sys
 
-def report(line):
-    print >> sys.stderr, ('motorvate: %s' % line)
+log = logging.getLogger('motorvate')
+
+def debug(line, *args):
+    log.debug(line, *args)
+
+def report(line, *args):
+    log.info(line, *args)
+
+def warn(line, *args):
+    log.warning(line, *args)
+
+class RingHandler(logging.Handler):
+    # Keeps the most recent records, formatting them only when dumped.
+    def __init__(self, capacity=1000):
+        logging.Handler.__init__(self)
+        self.records = deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s motorvate: %(message)s'))
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def dump(self, stream=sys.stderr):
+        for record in list(self.records):
+            print >> stream, self.format(record)
+        self.records.clear()
+
+def keepRecent(capacity=1000, level=logging.DEBUG):
+    # Record recent events down to level, even if not printed.
+    ring = RingHandler(capacity)
+    ring.setLevel(level)
+    log.addHandler(ring)
+    if log.getEffectiveLevel() > level:
+        for handler in log.handlers:
+            if handler.level == logging.NOTSET:
+                handler.setLevel(log.getEffectiveLevel())
+        log.setLevel(level)
+    return ring
+
+if not log.handlers:
+    stderr = logging.StreamHandler(sys.stderr)
+    stderr.setFormatter(logging.Formatter('motorvate: %(message)s'))
+    log.addHandler(stderr)
+    name = os.getenv('XRD_LOG', 'INFO').upper()
+    level = getattr(logging, name, None)
+    if isinstance(level, int):
+        log.setLevel(level)
+    else:
+        log.setLevel(logging.INFO)
+        warn('Unknown XRD_LOG level %r, using INFO', name)
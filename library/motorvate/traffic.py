@@ -0,0 +1,315 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Recording and replay of link traffic.
+#
+# A RecordingConnection stands in for a link's Modbus client and logs
+# every request with its timing and response to a compact binary trace.
+# A ReplayConnection serves those responses back without the device,
+# either as fast as asked or taking as long as the device took.
+#
+# Trace layout, all big endian: a header of MAGIC, a version byte and
+# the wall clock start time, then one record per request:
+#
+#     at (f), elapsed (f), function (B), status (B), address (H), count (H)
+#     request words (H each): the value written, or every value written
+#     response words (H each): registers read, or the echoed address and
+#     value or count
+
+from collections import namedtuple
+from time import time, sleep
+
+import struct
+
+from pymodbus.pdu import ExceptionResponse
+
+from pymodbus.register_read_message import ReadInputRegistersResponse
+from pymodbus.register_write_message import WriteSingleRegisterResponse
+from pymodbus.register_write_message import WriteMultipleRegistersResponse
+
+MAGIC = 'XRDT'
+VERSION = 1
+
+HEADER = struct.Struct('>4sBd')
+RECORD = struct.Struct('>ffBBHH')
+
+# Modbus function codes used by the link.
+READ_INPUT = 4
+WRITE_SINGLE = 6
+WRITE_MULTIPLE = 16
+
+FUNCTION_NAMES = {
+    READ_INPUT:     'read',
+    WRITE_SINGLE:   'write',
+    WRITE_MULTIPLE: 'write_block',
+}
+
+# How a recorded request ended.
+STATUS_OK = 0
+STATUS_FAILED = 1   # no response, or an exception response
+STATUS_RAISED = 2   # the client raised an exception
+
+TraceRecord = namedtuple('TraceRecord',
+    'at elapsed function status address count request response')
+
+class TraceMismatch(RuntimeError):
+    pass
+
+def requestWords(req):
+    if req.function_code == WRITE_SINGLE:
+        return [req.value]
+    if req.function_code == WRITE_MULTIPLE:
+        return list(req.values)
+    return []
+
+def requestCount(req):
+    if req.function_code == WRITE_SINGLE:
+        return 1
+    return req.count
+
+def responseWords(function, res):
+    if function == READ_INPUT:
+        return list(res.registers)
+    if function == WRITE_SINGLE:
+        return [res.address, res.value]
+    return [res.address, res.count]
+
+def responseLength(function, count):
+    if function == READ_INPUT:
+        return count
+    return 2
+
+def echoWords(req):
+    # Response words a device echoes for a write request.
+    if req.function_code == WRITE_SINGLE:
+        return [req.address, req.value]
+    return [req.address, req.count]
+
+def makeResponse(function, words):
+    if function == READ_INPUT:
+        return ReadInputRegistersResponse(list(words))
+    if function == WRITE_SINGLE:
+        return WriteSingleRegisterResponse(words[0], words[1])
+    return WriteMultipleRegistersResponse(words[0], words[1])
+
+def packWords(words):
+    return struct.pack('>%dH' % len(words), *words)
+
+class TraceWriter(object):
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.start = time()
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.start))
+        self.records = 0
+
+    def write(self, t1, elapsed, req, status, res=None):
+        function = req.function_code
+        self.file.write(RECORD.pack(t1 - self.start, elapsed, function, status,
+                                    req.address, requestCount(req)))
+        self.file.write(packWords(requestWords(req)))
+        if status == STATUS_OK:
+            self.file.write(packWords(responseWords(function, res)))
+        self.records += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def readTrace(path):
+    # Yield each TraceRecord in a trace file.
+    f = open(path, 'rb')
+    try:
+        magic, version, start = HEADER.unpack(f.read(HEADER.size))
+        if (magic != MAGIC) or (version != VERSION):
+            raise ValueError('%s is not a version %d trace' % (path, VERSION))
+        while True:
+            data = f.read(RECORD.size)
+            if not data:
+                break
+            at, elapsed, function, status, address, count = RECORD.unpack(data)
+            request = []
+            if function == WRITE_SINGLE:
+                request = readWords(f, 1)
+            elif function == WRITE_MULTIPLE:
+                request = readWords(f, count)
+            response = []
+            if status == STATUS_OK:
+                response = readWords(f, responseLength(function, count))
+            yield TraceRecord(at, elapsed, function, status,
+                              address, count, request, response)
+    finally:
+        f.close()
+
+def readWords(f, count):
+    data = f.read(2 * count)
+    if len(data) != 2 * count:
+        raise ValueError('Trace truncated')
+    return list(struct.unpack('>%dH' % count, data))
+
+def summarizeTrace(path):
+    # Requests, failures and device time per kind of request.
+    summary = {}
+    for record in readTrace(path):
+        name = FUNCTION_NAMES.get(record.function, str(record.function))
+        entry = summary.setdefault(name,
+            {'requests': 0, 'failed': 0, 'words': 0, 'elapsed_s': 0.0})
+        entry['requests'] += 1
+        entry['failed'] += int(record.status != STATUS_OK)
+        entry['words'] += record.count
+        entry['elapsed_s'] += record.elapsed
+    return summary
+
+class RecordingConnection(object):
+    # Wraps a Modbus client, logging every request it executes.
+    def __init__(self, conn, path):
+        self.conn = conn
+        self.writer = TraceWriter(path)
+
+    def connect(self):
+        return self.conn.connect()
+
+    def execute(self, req):
+        t1 = time()
+        try:
+            res = self.conn.execute(req)
+        except Exception:
+            self.writer.write(t1, time() - t1, req, STATUS_RAISED)
+            raise
+        if (res is None) or isinstance(res, ExceptionResponse):
+            self.writer.write(t1, time() - t1, req, STATUS_FAILED)
+        else:
+            self.writer.write(t1, time() - t1, req, STATUS_OK, res)
+        return res
+
+    def close(self):
+        self.writer.close()
+        self.conn.close()
+
+def recordLink(link, path):
+    # Start recording a link's traffic to a trace file.
+    link.conn = RecordingConnection(link.conn, path)
+    return link.conn
+
+class ReplayConnection(object):
+    # Serves recorded responses in place of a Modbus client.
+    #
+    # Strict replay expects exactly the recorded requests in order and
+    # raises TraceMismatch otherwise. Loose replay lets changed code run
+    # against old traffic: each request gets the next recorded response
+    # to the same function, address and count, the last one again once
+    # those run out, so status polls still finish, and requests never
+    # recorded are answered from the last known words. With timing, each
+    # request takes as long as it did on the device.
+    def __init__(self, path, strict=True, timing=False):
+        self.records = list(readTrace(path))
+        self.strict = strict
+        self.timing = timing
+        self.position = 0
+        self.queues = {}
+        for record in self.records:
+            key = (record.function, record.address, record.count)
+            self.queues.setdefault(key, []).append(record)
+        self.last = {}
+        self.words = {}
+        self.served = 0
+        self.repeated = 0
+        self.synthesized = 0
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def remaining(self):
+        return len(self.records) - self.position
+
+    def execute(self, req):
+        function = req.function_code
+        key = (function, req.address, requestCount(req))
+        if self.strict:
+            record = self.next(key, requestWords(req))
+        else:
+            record = self.match(key)
+        if record is None:
+            return self.synthesize(req)
+
+        if self.timing:
+            sleep(record.elapsed)
+        self.served += 1
+        if record.status == STATUS_RAISED:
+            raise IOError('Recorded failure at address %d' % record.address)
+        if record.status != STATUS_OK:
+            return None
+        response = record.response
+        if (not self.strict) and (function != READ_INPUT):
+            # Writes may carry new values, so echo what was sent.
+            response = echoWords(req)
+        self.learn(req, response)
+        return makeResponse(function, response)
+
+    def next(self, key, request):
+        if self.position >= len(self.records):
+            raise TraceMismatch('Request %r after end of trace' % (key,))
+        record = self.records[self.position]
+        recorded = (record.function, record.address, record.count)
+        if recorded != key:
+            raise TraceMismatch('Request %r, recorded %r' % (key, recorded))
+        if record.request != request:
+            raise TraceMismatch('Request %r wrote %r, recorded %r'
+                                % (key, request, record.request))
+        self.position += 1
+        return record
+
+    def match(self, key):
+        queue = self.queues.get(key)
+        if queue:
+            record = queue.pop(0)
+            self.last[key] = record
+            self.position += 1
+            return record
+        if key in self.last:
+            self.repeated += 1
+            return self.last[key]
+        return None
+
+    def learn(self, req, response):
+        # Track the last known value of every word for loose replay.
+        if req.function_code == READ_INPUT:
+            for (index, word) in enumerate(response):
+                self.words[req.address + index] = word
+        else:
+            for (index, word) in enumerate(requestWords(req)):
+                self.words[req.address + index] = word
+
+    def synthesize(self, req):
+        self.synthesized += 1
+        function = req.function_code
+        self.learn(req, [])
+        if function == READ_INPUT:
+            words = [self.words.get(req.address + index, 0)
+                     for index in xrange(req.count)]
+        else:
+            words = echoWords(req)
+        return makeResponse(function, words)
@@ -0,0 +1,78 @@
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Wait strategies for polling until an operation completes.
+#
+# A strategy's begin(expected) returns an iterator of delays in seconds
+# to sleep between polls, given the expected duration if known. It
+# raises WaitTimeout once the deadline has passed.
+
+from time import time
+
+# Longest wait beyond any expected duration before giving up.
+DEFAULT_TIMEOUT = 600.0
+
+class WaitTimeout(RuntimeError):
+    pass
+
+class FixedWait(object):
+    # Poll at a constant interval.
+    def __init__(self, interval=0.1, timeout=DEFAULT_TIMEOUT):
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+
+    def begin(self, expected=None):
+        deadline = time() + (expected or 0.0) + self.timeout
+        while True:
+            if time() > deadline:
+                raise WaitTimeout('No completion after %.1f s' % self.timeout)
+            yield self.interval
+
+class AdaptiveWait(object):
+    # Poll slowly until the expected completion time, tightly around it,
+    # then back off geometrically if it is late or was never predicted.
+    def __init__(self, minInterval=0.01, maxInterval=0.5, backoff=1.5,
+                 timeout=DEFAULT_TIMEOUT):
+        self.minInterval = float(minInterval)
+        self.maxInterval = float(maxInterval)
+        self.backoff = float(backoff)
+        self.timeout = float(timeout)
+
+    def begin(self, expected=None):
+        start = time()
+        deadline = start + (expected or 0.0) + self.timeout
+        interval = self.minInterval
+        while True:
+            now = time()
+            if now > deadline:
+                raise WaitTimeout('No completion after %.1f s' % (now - start))
+
+            if expected is not None:
+                remaining = (start + expected) - now
+                if remaining > self.minInterval:
+                    yield min(remaining, self.maxInterval)
+                    continue
+
+            yield interval
+            interval = min(interval * self.backoff, self.maxInterval)
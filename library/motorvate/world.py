@@ -25,11 +25,23 @@
 from counters import Counters
 from motor import Motor
 from relay import Relay
-from analog import Analog
+from analog import Analog, AnalogGroup
+from link import readRegisters
+from registermap import ReadPlan, checkMap, deviceArguments
+from instrument import traced
+from tools import debug, report
+from waits import AdaptiveWait
+
+from time import time, sleep
 
 # Base address for relays and counter control.
 RC_BASE   = 42001
 
+RELAY_BITS = [0, 1, 7]
+
+COUNTER_START = 8 # 'Start' for all counters.
+COUNTER_BUSY  = 9 # 'Stop' indicator for all counters.
+
 ANALOGS   = [42013, 42017, 42021, 42025]
 
 MOTOR_YS  = (42002, 42037)
@@ -40,34 +52,122 @@ MOTOR_TH2 = (42006, 42061)
 
 MOTORS = [MOTOR_YS, MOTOR_YA, MOTOR_ZS, MOTOR_TH1, MOTOR_TH2]
 
+MOTOR_NAMES = ['ys', 'ya', 'zs', 'th1', 'th2']
+
+# Bits within each motor's control word.
+MOTOR_ENABLE = 0
+MOTOR_MOVE   = 1
+MOTOR_HOME   = 3
+MOTOR_MOVING = 4
+
 COUNTER_TIME   = 42073
 COUNTER_VALUES = [42029, 42031, 42033, 42035]
 
+# The map above as a declarative description.
+def worldMap():
+    devices  = [{'type': 'relay', 'switch': (RC_BASE, bit)} for bit in RELAY_BITS]
+    devices += [{'type': 'analog', 'value': aValue} for aValue in ANALOGS]
+    devices += [{
+        'type':   'counters',
+        'switch': (RC_BASE, COUNTER_START),
+        'busy':   (RC_BASE, COUNTER_BUSY),
+        'time':   COUNTER_TIME,   # 'Time' for all counters counter (two words).
+        'values': COUNTER_VALUES, # Value for each counter (two words each).
+    }]
+    devices += [{
+        'type':     'motor',
+        'name':     name,
+        'switch':   (base, MOTOR_ENABLE),
+        'home':     (base, MOTOR_HOME),
+        'move':     (base, MOTOR_MOVE),
+        'moving':   (base, MOTOR_MOVING),
+        'position': position, # Set position.
+    } for (name, (base, position)) in zip(MOTOR_NAMES, MOTORS)]
+    return devices
+
+WORLD_MAP = worldMap()
+
+# Device class for each type in a map.
+DEVICE_CLASSES = {
+    'relay':    Relay,
+    'analog':   Analog,
+    'counters': Counters,
+    'motor':    Motor,
+}
+
+# Attributes set on every World, which device names may not replace.
+WORLD_ATTRIBUTES = ['link', 'devices', 'relays', 'analogs', 'outputs',
+                    'counters', 'motors', 'plan', 'waits']
+
 class World(object):
-    def __init__(self, link):
+    def __init__(self, link, devices=WORLD_MAP):
         self.link = link
+        self.devices = checkMap(devices, WORLD_ATTRIBUTES + dir(World))
+
+        # Build every device, grouped by type and bound by name.
+        built = dict([(kind, []) for kind in DEVICE_CLASSES])
+        for device in self.devices:
+            kind = device['type']
+            instance = DEVICE_CLASSES[kind](link, *deviceArguments(device))
+            built[kind].append(instance)
+            if device.get('name'):
+                setattr(self, device['name'], instance)
+
+        self.relays = built['relay']
+        self.analogs = built['analog']
+        if self.analogs:
+            self.outputs = AnalogGroup(link, self.analogs)
+        self.counters = (built['counters'] or [None])[0]
+        self.motors = built['motor']
+
+        # Fewest block reads covering the whole map.
+        self.plan = ReadPlan(self.devices)
+
+        # Strategy for polling until all moving axes have stopped.
+        self.waits = AdaptiveWait()
+
+    def snapshot(self):
+        # Every mapped word, read in as few requests as possible.
+        return self.plan.read(self.link)
+
+    # Multi-axis motion.
+
+    @traced('World.move_many')
+    def move_many(self, positions):
+        report("World.move_many(%r)", positions)
+        expected = [motor.expectMove(positions[motor]) for motor in positions]
+        motors = [motor for motor in positions if motor.startMove(positions[motor])]
+        stopped = self.waitMotors(motors, longest(expected))
+        for motor in motors:
+            motor.finishMove(stopped[motor])
+
+    @traced('World.home_all')
+    def home_all(self):
+        report("World.home_all()")
+        motors = [motor for motor in self.motors if motor.startHome()]
+        self.waitMotors(motors)
+        for motor in motors:
+            motor.finishHome()
+
+    def waitMotors(self, motors, expected=None):
+        # Poll every moving bit at once until all axes have stopped,
+        # returning the time each axis was first seen stopped.
+        rMoving = [motor.rMoving for motor in motors]
+        delays = self.waits.begin(expected)
+        stopped = {}
+        while True:
+            moving = readRegisters(self.link, rMoving)
+            debug("World.waitMotors() -> %r", moving)
+            now = time()
+            for (motor, busy) in zip(motors, moving):
+                if (not busy) and (motor not in stopped):
+                    stopped[motor] = now
+            if not any(moving):
+                return stopped
+            sleep(delays.next())
 
-        self.relays = [Relay(link, (RC_BASE, bit)) for bit in [0, 1, 7]]
-
-        self.analogs = [Analog(link, aValue) for aValue in ANALOGS]
-
-        self.counters = Counters(link,
-            (RC_BASE, 8),   # 'Start' for all counters.
-            (RC_BASE, 9),   # 'Stop' indicator for all counters.
-            COUNTER_TIME,   # 'Time' for all counters counter (two words).
-            COUNTER_VALUES, # Value for each counter (two words each).
-        )
-
-        self.motors = [
-            Motor(
-                link,
-                (base, 0), # Enable.
-                (base, 3), # Home.
-                (base, 1), # Move.
-                (base, 4), # Moving.
-                position   # Set position.
-            )
-            for (base, position) in MOTORS
-        ]
-
-        (self.ys, self.ya, self.zs, self.th1, self.th2) = self.motors
+def longest(durations):
+    # Longest expected duration, or None if any is unknown.
+    if None in durations:
+        return None
+    return max(durations or [0.0])
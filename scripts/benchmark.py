@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Benchmarks high level operations against the simulated controller,
+# reporting Modbus transactions, bytes, wall time and latency for each.
+#
+# Usage: benchmark.py [output.json [baseline.json]]
+#
+# With a baseline, prints how transactions per operation have changed.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink
+from motorvate.world import World
+from motorvate.scan import StepScan
+
+import json
+import os
+import sys
+import time
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+def bench(simulator, name, operation, repeat):
+    requests = simulator.requests
+    bytes = simulator.bytesIn + simulator.bytesOut
+    latencies = []
+    start = time.time()
+    for index in xrange(repeat):
+        t1 = time.time()
+        operation(index)
+        latencies.append(time.time() - t1)
+    wall = time.time() - start
+
+    return {
+        'name':         name,
+        'repeat':       repeat,
+        'transactions': (simulator.requests - requests) / float(repeat),
+        'bytes':        (simulator.bytesIn + simulator.bytesOut - bytes) / float(repeat),
+        'wall_s':       wall,
+        'p50_ms':       percentile(latencies, 0.50) * 1000,
+        'p99_ms':       percentile(latencies, 0.99) * 1000,
+    }
+
+def home(world, index):
+    # Forget the last home so every repeat homes the axis again.
+    world.ys.forget()
+    world.ys.home()
+
+def scan(world, index):
+    for point in StepScan(world, [world.ys], [100, 200, 300, 400, 500], 20):
+        pass
+
+def run(simulator, world, repeat):
+    positions = [100, 200]
+    return [
+        bench(simulator, 'Relay.enable',     lambda index: world.relays[0].enable(), repeat),
+        bench(simulator, 'Analog.set',       lambda index: world.analogs[0].set(index * 0.01), repeat),
+        bench(simulator, 'Motor.move',       lambda index: world.ys.move(positions[index % 2]), repeat),
+        bench(simulator, 'Motor.home',       lambda index: home(world, index), repeat),
+        bench(simulator, 'Counters.measure', lambda index: world.counters.measure(20), repeat),
+        bench(simulator, 'StepScan(5)',      lambda index: scan(world, index), max(repeat // 5, 1)),
+    ]
+
+def compare(results, baseline):
+    before = dict([(result['name'], result) for result in baseline])
+    for result in results:
+        if result['name'] not in before:
+            continue
+        old = before[result['name']]['transactions']
+        new = result['transactions']
+        print '%-18s %8.1f -> %8.1f transactions%s' % (
+            result['name'], old, new, (new > old) and '  REGRESSED' or '')
+
+if __name__ == '__main__':
+    output = (len(sys.argv) > 1) and sys.argv[1] or 'benchmark.json'
+    repeat = int(os.getenv('BENCH_REPEAT', '20'))
+
+    simulator = Simulator(
+        speed   = 10000.0,
+        latency = float(os.getenv('SIM_LATENCY_MS', '1')) / 1000.0,
+        jitter  = float(os.getenv('SIM_JITTER_MS', '0')) / 1000.0,
+    )
+    port = simulator.start()
+    world = World(ControlLink('localhost', port))
+    results = run(simulator, world, repeat)
+    simulator.stop()
+
+    for result in results:
+        print ('%(name)-18s %(transactions)6.1f req %(bytes)8.1f B '
+               '%(p50_ms)8.2f ms p50 %(p99_ms)8.2f ms p99' % result)
+
+    stream = open(output, 'w')
+    json.dump(results, stream, indent=2)
+    stream.close()
+
+    if len(sys.argv) > 2:
+        stream = open(sys.argv[2])
+        compare(results, json.load(stream))
+        stream.close()
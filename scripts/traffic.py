@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Summarizes recorded link traffic, optionally against a baseline trace.
+#
+# Usage: traffic.py trace [baseline]
+#
+# Record a trace by running any script with XRD_TRACE=path, and replay
+# it offline with XRD_REPLAY=path (and XRD_REPLAY_TIMING=1 to take as
+# long as the device did).
+
+from motorvate.traffic import summarizeTrace
+
+import sys
+
+KINDS = ['read', 'write', 'write_block']
+
+def total(summary, field):
+    return sum([entry[field] for entry in summary.values()])
+
+def show(name, summary):
+    print name
+    for kind in KINDS:
+        if kind in summary:
+            print ('  %(kind)-12s %(requests)6d req %(words)8d words '
+                   '%(failed)4d failed %(ms)10.1f ms' %
+                   dict(summary[kind], kind=kind, ms=summary[kind]['elapsed_s'] * 1000))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'Usage: %s trace [baseline]' % sys.argv[0]
+        sys.exit(1)
+
+    summary = summarizeTrace(sys.argv[1])
+    show(sys.argv[1], summary)
+
+    if len(sys.argv) > 2:
+        baseline = summarizeTrace(sys.argv[2])
+        show(sys.argv[2], baseline)
+        print 'requests %d -> %d, device time %.1f -> %.1f ms' % (
+            total(baseline, 'requests'), total(summary, 'requests'),
+            total(baseline, 'elapsed_s') * 1000, total(summary, 'elapsed_s') * 1000)
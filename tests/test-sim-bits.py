@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks control word bit merging against the simulator, including a
+# second client changing other bits of the same word.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink, batchBits
+from motorvate.world import World, RC_BASE, COUNTER_BUSY
+from motorvate.traffic import WRITE_SINGLE, readTrace, recordLink
+
+import os
+import tempfile
+
+if __name__ == '__main__':
+    simulator = Simulator()
+    port = simulator.start()
+    a = World(ControlLink('localhost', port))
+    b = World(ControlLink('localhost', port))
+
+    # Bits set by another client survive.
+    a.relays[0].enable()
+    b.relays[1].enable()
+    a.relays[2].enable()
+    word = simulator.words[RC_BASE]
+    print 'control word: %s' % bin(word)
+    assert word == 0x83
+
+    # One read and one write for a batch of bits in one word.
+    switches = [relay.rSwitch for relay in a.relays]
+    requests = simulator.requests
+    with batchBits(*switches):
+        for switch in switches:
+            switch.write(False)
+    assert simulator.requests - requests == 2
+    assert simulator.words[RC_BASE] == 0
+
+    # A reused shadow never writes back the device's busy bit.
+    handle, path = tempfile.mkstemp('.trace')
+    os.close(handle)
+    c = World(ControlLink('localhost', port, shadowAge=60.0))
+    c.counters.startMeasure(1000)
+    assert c.counters.isBusy()
+    recorder = recordLink(c.link, path)
+    c.relays[0].enable()
+    c.counters.stop()
+    recorder.close()
+    written = [record.request[0] for record in readTrace(path)
+               if record.function == WRITE_SINGLE]
+    print 'written with shadow: %s' % map(bin, written)
+    assert written and not (written[0] >> COUNTER_BUSY) & 1
+    os.unlink(path)
+
+    simulator.stop()
+    print 'OK'
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks the cached link against the simulator: reads inside the map are
+# shared, but control words are read from the device before each write,
+# so bits set by another client meanwhile survive.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink
+from motorvate.cache import CachedLink
+from motorvate.registermap import ReadPlan
+from motorvate.world import World, WORLD_MAP, RC_BASE
+
+if __name__ == '__main__':
+    simulator = Simulator()
+    port = simulator.start()
+    a = World(CachedLink('localhost', port, 'read', ReadPlan(WORLD_MAP).blocks, 1.0))
+    b = World(ControlLink('localhost', port))
+
+    # Status reads within the ttl come from one snapshot.
+    a.counters.isBusy()
+    requests = simulator.requests
+    for motor in a.motors:
+        motor.isMoving()
+    assert simulator.requests == requests
+
+    # A stale snapshot does not undo another client's bit.
+    b.relays[1].enable()
+    a.relays[0].enable()
+    word = simulator.words[RC_BASE]
+    print 'control word: %s' % bin(word)
+    assert word == 0x3
+
+    simulator.stop()
+    print 'OK'
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks the daemon against the simulator: a second client stops a count
+# started by the first without waiting for it to finish, and results keep
+# their types through the proxies.
+
+from motorvate.simulator import Simulator
+from motorvate.queued import QueuedLink
+from motorvate.world import World
+from motorvate.daemon import WorldServer, WorldClient
+from motorvate.counters import CountSample, PreciseCount
+from motorvate.analog import Playback
+
+from time import time, sleep
+
+import os
+import tempfile
+import threading
+
+if __name__ == '__main__':
+    simulator = Simulator()
+    port = simulator.start()
+    path = tempfile.mktemp('.sock')
+    server = WorldServer(path, World(QueuedLink('localhost', port, 'read')))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    a = WorldClient(path)
+    b = WorldClient(path)
+    result = []
+    counting = threading.Thread(target=lambda: result.append(a.counters.measure(5000)))
+    counting.start()
+    while not b.counters.isBusy():
+        sleep(0.01)
+
+    # Stopping and disabling do not wait behind the running count, which
+    # then ends at its next poll.
+    t1 = time()
+    b.relays[0].disable()
+    b.counters.stop()
+    stopped = time() - t1
+    counting.join(10.0)
+    ended = time() - t1
+    print 'stopped in %.3f s, count ended after %.3f s: %r' % (stopped, ended, result)
+    assert (stopped < 0.5) and result and (ended < 2.5)
+
+    # Results keep their types through the proxy.
+    samples = a.counters.measure_series(50, 2)
+    assert [type(sample) for sample in samples] == [CountSample, CountSample]
+    precise = a.counters.measure_precise(0, 0.5, 200)
+    assert isinstance(precise, PreciseCount) and (precise.live_ms <= 200)
+    playback = a.outputs.play([[0.0] * len(a.analogs)] * 2, 20.0)
+    assert isinstance(playback, Playback) and (playback.samples == 2)
+
+    a.close()
+    b.close()
+    server.shutdown()
+    server.server_close()
+    os.unlink(path)
+    simulator.stop()
+    print 'OK'
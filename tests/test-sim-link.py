@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks block planning and batched reads against the simulator.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink, planBlocks, MAX_READ_COUNT
+
+if __name__ == '__main__':
+    assert planBlocks([]) == []
+    assert planBlocks([5, 1, 3, 3]) == [(1, 5)]
+    assert planBlocks([1, 20], 8) == [(1, 1), (20, 1)]
+    assert planBlocks([1, 20], 20) == [(1, 20)]
+    assert planBlocks(range(300), 0) == [(0, 125), (125, 125), (250, 50)]
+    assert planBlocks([0, MAX_READ_COUNT], MAX_READ_COUNT) == [(0, 1), (MAX_READ_COUNT, 1)]
+
+    simulator = Simulator()
+    link = ControlLink('localhost', simulator.start())
+    for offset in xrange(42100, 42400):
+        simulator.words[offset] = offset - 42000
+
+    # Scattered addresses come back in the order asked, in few requests.
+    offsets = [42150, 42101, 42103, 42101, 42390]
+    requests = simulator.requests
+    assert link.read_many(offsets) == [150, 101, 103, 101, 390]
+    print 'read_many: %d requests' % (simulator.requests - requests)
+    assert simulator.requests - requests == 3
+
+    # Long blocks are split at the request limit.
+    requests = simulator.requests
+    assert link.read_block(42100, 300) == range(100, 400)
+    assert simulator.requests - requests == 3
+
+    # Contiguous writes go out as one block, then one verify read.
+    requests = simulator.requests
+    assert link.write_many([42501, 42500, 42502], [1, 0, 2]) == [1, 0, 2]
+    assert simulator.requests - requests == 2
+
+    simulator.stop()
+    print 'OK'
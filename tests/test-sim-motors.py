@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks that repeated motor commands are skipped only while the device
+# still agrees, including after another client moved the axis.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink
+from motorvate.world import World
+
+if __name__ == '__main__':
+    simulator = Simulator()
+    port = simulator.start()
+    a = World(ControlLink('localhost', port))
+    b = World(ControlLink('localhost', port))
+    axis = simulator.motors[0]
+
+    # A repeated move costs one status read.
+    a.ys.move(100)
+    requests = simulator.requests
+    a.ys.move(100)
+    assert simulator.requests - requests == 1
+
+    # Another client's move is noticed.
+    b.ys.move(500)
+    a.ys.move(100)
+    print 'after moves: %r' % axis.position
+    assert axis.position == 100
+
+    # A repeated home is skipped, but not after another client's move.
+    a.ys.home()
+    requests = simulator.requests
+    a.ys.home()
+    assert simulator.requests - requests == 1
+    b.ys.move(300)
+    a.ys.home()
+    print 'after homing: %r' % axis.position
+    assert axis.position == simulator.home
+
+    simulator.stop()
+    print 'OK'
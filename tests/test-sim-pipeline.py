@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks the pipelined link against the simulator: overlapped reads and
+# writes return the device's words, and a request that times out gives
+# its window slot back at once.
+
+from motorvate.simulator import Simulator
+from motorvate.pipeline import PipelinedLink
+from motorvate.world import RC_BASE
+
+from time import sleep
+
+if __name__ == '__main__':
+    simulator = Simulator()
+    port = simulator.start()
+    link = PipelinedLink('localhost', port, window=4, connections=2, timeout=0.2)
+
+    # Overlapped writes, then overlapped reads of the same words.
+    offsets = range(RC_BASE, RC_BASE + 8)
+    futures = [link.write_async(offset, index + 1)
+               for (index, offset) in enumerate(offsets)]
+    assert [future.result() for future in futures] == range(1, 9)
+    futures = [link.read_block_async(offset, 1) for offset in offsets]
+    assert [future.result()[0] for future in futures] == range(1, 9)
+    assert link.read_many(offsets) == range(1, 9)
+    assert [simulator.words[offset] for offset in offsets] == range(1, 9)
+
+    # Timed out requests free their slots without waiting for replies.
+    simulator.latency = 0.5
+    for index in xrange(2):
+        try:
+            link.read(RC_BASE)
+        except RuntimeError, error:
+            print 'timed out: %s' % error
+        else:
+            assert False
+    for connection in link.pool:
+        assert (connection.free == link.window) and (not connection.pending)
+
+    # Late replies are discarded, and the link keeps working.
+    simulator.latency = 0.0
+    sleep(1.5)
+    for connection in link.pool:
+        assert not connection.dropped
+    link.write_block(RC_BASE, [0] * 8)
+    assert link.read_block(RC_BASE, 8) == [0] * 8
+
+    link.close()
+    simulator.stop()
+    print 'OK'
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks the limits of precise counting against the simulator.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink
+from motorvate.world import World
+
+if __name__ == '__main__':
+    simulator = Simulator(rates=(1000.0, 2000.0, 3000.0, 4000.0))
+    world = World(ControlLink('localhost', simulator.start()))
+    counters = world.counters
+
+    # Unreachable precision stops at max_ms, never beyond.
+    result = counters.measure_precise(0, 0.001, 150)
+    print result
+    assert result.live_ms == 150
+
+    # 1% needs 10000 counts, 10 s at 1000/s, so it stops at max_ms too.
+    result = counters.measure_precise(0, 0.01, 250, 100)
+    assert result.live_ms <= 250
+
+    # 10% needs 100 counts, reached within the first slice.
+    result = counters.measure_precise(0, 0.1, 1000)
+    assert (result.slices == 1) and (result.counts[0] >= 100)
+
+    for args in [(0, 0, 100), (0, -0.1, 100), (9, 0.1, 100), (0, 0.1, 0)]:
+        try:
+            counters.measure_precise(*args)
+        except ValueError, error:
+            print 'rejected %r: %s' % (args, error)
+        else:
+            raise AssertionError('accepted %r' % (args,))
+
+    simulator.stop()
+    print 'OK'
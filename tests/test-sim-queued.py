@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks the queued link against the simulator: urgent requests go
+# first, then writes, then reads; reads of a block already waiting share
+# its response; and a request nobody waits for any more is never sent.
+
+from motorvate.simulator import Simulator
+from motorvate.queued import QueuedLink
+from motorvate.world import RC_BASE, COUNTER_TIME, COUNTER_VALUES
+from motorvate.traffic import READ_INPUT, WRITE_SINGLE, readTrace, recordLink
+
+from time import sleep
+
+import os
+import tempfile
+import threading
+
+def later(function, *args):
+    # Call in another thread, ignoring timeouts.
+    def call():
+        try:
+            function(*args)
+        except RuntimeError:
+            pass
+    thread = threading.Thread(target=call)
+    thread.start()
+    sleep(0.05)
+    return thread
+
+def urgentWrite(link, offset, value):
+    with link.urgent():
+        link.write(offset, value)
+
+if __name__ == '__main__':
+    handle, path = tempfile.mkstemp('.trace')
+    os.close(handle)
+
+    # Each request keeps the I/O thread busy long enough to queue others.
+    simulator = Simulator(latency=0.2)
+    link = QueuedLink('localhost', simulator.start())
+    recorder = recordLink(link, path)
+
+    # Urgent requests, then writes, then reads.
+    threads = [later(link.read, RC_BASE),
+               later(link.read, COUNTER_VALUES[0]),
+               later(link.write, COUNTER_TIME, 0),
+               later(urgentWrite, link, COUNTER_TIME + 1, 0)]
+    for thread in threads:
+        thread.join()
+
+    # Reads of a waiting block share one request.
+    requests = simulator.requests
+    threads = [later(link.read, RC_BASE)]
+    threads += [later(link.read_block, COUNTER_VALUES[0], 2) for index in xrange(3)]
+    for thread in threads:
+        thread.join()
+    assert link.coalesced == 2
+    assert simulator.requests - requests == 2
+
+    # A write given up on while queued is dropped.
+    thread = later(link.read, RC_BASE)
+    link.timeout = 0.1
+    try:
+        link.write(COUNTER_VALUES[3], 1234)
+    except RuntimeError, error:
+        print 'gave up: %s' % error
+    else:
+        assert False
+    thread.join()
+    sleep(0.3)
+
+    link.close()
+    simulator.stop()
+    order = [(record.function, record.address + 40000) for record in readTrace(path)]
+    print 'sent: %r' % order
+    assert order[:4] == [(READ_INPUT, RC_BASE), (WRITE_SINGLE, COUNTER_TIME + 1),
+                         (WRITE_SINGLE, COUNTER_TIME), (READ_INPUT, COUNTER_VALUES[0])]
+    assert order[-1] == (READ_INPUT, RC_BASE)
+    assert COUNTER_VALUES[3] not in [address for (function, address) in order]
+    os.unlink(path)
+    print 'OK'
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2010-2011 Dmitri Nikulin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Records traffic against the simulator, then replays it strictly
+# without the simulator and checks a changed request is caught.
+
+from motorvate.simulator import Simulator
+from motorvate.link import ControlLink
+from motorvate.world import World
+from motorvate.traffic import ReplayConnection, TraceMismatch, recordLink
+
+import os
+import tempfile
+
+def session(world):
+    world.relays[0].enable()
+    world.analogs[0].set(0.5)
+    world.ys.move(150)
+    return world.counters.measure(20)
+
+if __name__ == '__main__':
+    handle, path = tempfile.mkstemp('.trace')
+    os.close(handle)
+
+    simulator = Simulator()
+    link = ControlLink('localhost', simulator.start())
+    recorder = recordLink(link, path)
+    counts = session(World(link))
+    recorder.close()
+    simulator.stop()
+    print 'recorded %d requests' % recorder.writer.records
+
+    replay = ReplayConnection(path)
+    assert session(World(ControlLink('replay', 0, conn=replay))) == counts
+    assert replay.remaining() == 0
+
+    replay = ReplayConnection(path)
+    world = World(ControlLink('replay', 0, conn=replay))
+    try:
+        world.relays[1].enable()
+    except TraceMismatch, error:
+        print 'mismatch caught: %s' % error
+    else:
+        raise AssertionError('changed request replayed')
+
+    os.unlink(path)
+    print 'OK'